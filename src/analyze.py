@@ -1,210 +1,630 @@
 import sys
-import string
 import os
-import re
+import hashlib
+import argparse
 import snorkel
-import nltk
 import pandas as pd
 
 import labelers
-from article    import Article
-from classifier import Classifier
-from relgraph   import RelGraph
-from histogram  import Histogram
-
-def main():
-  # Setup
-  pd.set_option('display.max_rows', None)
-  pd.set_option('display.max_colwidth', 200)
-
-  article_dir       = '../articles'
-  png_dir           = '../pngs'
-  training_set_size = 2000
-  top_choices       = 10
-
+from ingest     import iter_articles
+from cache      import TextCache
+from extract    import Extractor, backends
+from corpus     import CorpusState
+from classifier import build_classifier, train_classifiers, train_stream, \
+                       ClassifierPool
+from features   import Featurizer, HashingFeaturizer
+from compiled   import CompiledModels, COMPILED_VERSION
+from pipeline   import draw_training, training_batches, classify_pending, \
+                       build_plots
+from tagger     import Tagger
+from terms      import load_stopwords
+from timing     import Timings
+from render     import render_plots, presets, formats
+from relgraph   import layouts
+from files      import repo_path
+
+renders = ('graph', 'histogram')
+
+# Sorted paths of the pdfs in the articles directory, or None if there are
+# none to work with
+def scan_articles(args, timings):
   # Validate article dir
-  if not os.path.exists(article_dir):
+  if not os.path.exists(args.articles):
     print('Article directory does not exist!', file=sys.stderr)
-    return
+    return None
 
   # Get all pdfs inside dir
-  print(f'Finding articles in directory: {article_dir}')
-  pdf_paths = [f'{article_dir}/{x}' for x in os.listdir(article_dir)]
-  pdf_paths = [x for x in pdf_paths if os.path.isfile(x) and x.endswith('.pdf')]
+  print(f'Finding articles in directory: {args.articles}')
+  with timings.stage('scan') as entry:
+    pdf_paths = [f'{args.articles}/{x}' for x in os.listdir(args.articles)]
+    pdf_paths = [x for x in pdf_paths
+                 if os.path.isfile(x) and x.endswith('.pdf')]
+    pdf_paths = sorted(pdf_paths)
+    entry['items'] += len(pdf_paths)
 
   # Validate articles
   if not pdf_paths:
     print('Article directory has no PDF files!', file=sys.stderr)
-    return
-
-  # Create article objects for pdfs found
-  print('Tokenizing all pdf files found...')
-  articles = []
-  for pdf_path in pdf_paths:
-    try:
-      articles.append(Article(pdf_path))
-    except (FileNotFoundError, UnicodeDecodeError):
-      print(f'Article path {pdf_path} is not a valid file!', file=sys.stderr)
-    except LookupError:
-      print('NLTK lookup error, try nltk.download(\'punkt\')', file=sys.stderr)
-      return
-
-  # Read articles
-  print('Extracting all sentences from articles into dataframe...')
-  sentence_rows = []
-  for article in articles:
-    for sentence in article.get_sentences():
-
-      # Filter out some useless sentences
-      if not labelers.simple_filter(sentence):
+    return None
+
+  return pdf_paths
+
+# Find new, modified and removed pdfs and extract the new ones into the
+# saved state. With keep_added, articles added from outside the articles
+# directory are kept. Returns the state, or None if there is nothing to
+# work with
+def ingest(args, timings, keep_added=False):
+  pdf_paths = scan_articles(args, timings)
+  if pdf_paths is None:
+    return None
+
+  with timings.stage('load_state'):
+    state = load_state(args)
+  keep = added_paths(args, state) if keep_added else ()
+  if update_corpus(args, timings, state, pdf_paths, keep) is None:
+    return None
+
+  # Sentences go to a memory mapped store next to the state, later runs and
+  # other tools open it without reading it into memory
+  save_state(args, timings, state)
+
+  return state
+
+# Paths of the articles added from outside the articles directory, never
+# found by a scan of it
+def added_paths(args, state):
+  return [x for x in state.records if not x.startswith(f'{args.articles}/')]
+
+# Bring the corpus state in line with pdf_paths, extracting new and
+# modified articles and dropping the ones not given, unless they are kept.
+# Returns the new or modified and the removed paths, or None if sentences
+# could not be tokenized
+def update_corpus(args, timings, state, pdf_paths, keep=()):
+  # Only new or modified articles need to go through extraction when
+  # resuming from a saved corpus state
+  stale_paths, removed_paths = state.changes(pdf_paths)
+  keep          = set(keep)
+  removed_paths = [x for x in removed_paths if x not in keep]
+  for path in removed_paths + stale_paths:
+    state.drop_article(path)
+  print(f'{len(stale_paths)} new or modified articles, '
+        f'{len(removed_paths)} removed')
+
+  # Extract new articles into the sentence store of the state
+  ingest_workers = workers(args, args.ingest_workers)
+  print(f'Tokenizing all pdf files found with {ingest_workers} workers...')
+  new_sentences = 0
+  new_kept      = 0
+  try:
+    text_cache = TextCache(os.path.join(args.cache_dir, 'text'),
+                           args.text_cache_bytes)
+    extractor  = Extractor(args.extractors, args.max_pages, args.timeout)
+    with timings.stage('extract') as entry:
+      for path, sentences, keep in iter_articles(stale_paths, ingest_workers,
+                                                 text_cache, extractor):
+        state.add_article(path, sentences, keep)
+        entry['items'] += 1
+        new_sentences  += len(sentences)
+        new_kept       += sum(keep)
+  except LookupError:
+    print('NLTK lookup error, try nltk.download(\'punkt\')', file=sys.stderr)
+    return None
+
+  timings.log('corpus', articles=len(state.records),
+              sentences=len(state.store), kept=int(state.store.keep.sum()),
+              new_articles=len(stale_paths), removed=len(removed_paths),
+              new_sentences=new_sentences, new_kept=new_kept)
+
+  return stale_paths, removed_paths
+
+# Load or train the models of the selected label sets. Classifiers without a
+# saved model are trained when train is 'all', only if they have articles
+# left to classify when it is 'pending', and never when it is 'none'. Models
+# are trained on a frozen training set, or with --stream-train out of core
+# on every filtered sentence of the corpus. The featurizer is loaded when
+# articles are left to classify, or always with features. Returns the
+# classifiers with a model along with the shared featurizer, or None if no
+# training set can be drawn
+def prepare_models(args, timings, state, train, features=False):
+  if not state.records:
+    print('No articles in the corpus state, run ingest first',
+          file=sys.stderr)
+    return None
+
+  # Build classifiers for the selected categories
+  print('Building classifiers...')
+  classifiers = [build_classifier(x) for x in args.label_sets]
+  model_dir   = os.path.join(args.cache_dir, 'models')
+
+  if args.stream_train:
+    # Hashed features need no fitting. Models depend on the whole corpus,
+    # they are retrained, and articles reclassified, whenever it changes
+    featurizer    = HashingFeaturizer(args.hash_features)
+    features_path = None
+    article_ids   = state.article_ids()
+    params        = f'{args.train_batch_size}:{args.epochs}'
+    with timings.stage('corpus_digest', len(article_ids)):
+      corpus_key = state.store.digest(article_ids)
+
+    # Validate sentences
+    if not any(len(state.store.kept_rows(x)) for x in article_ids):
+      print('Could not extract enough sentences to train on!',
+            file=sys.stderr)
+      return None
+
+    def model_key(cl):
+      return cl.stream_fingerprint(corpus_key, featurizer.fingerprint(),
+                                   params)
+  else:
+    # Draw the training set once, it stays frozen in the state so the
+    # models, and therefore the saved predictions, stay valid across runs
+    if state.training is None:
+      print('Drawing training set from all sentences...')
+      with timings.stage('draw_training', args.training_size):
+        state.training = draw_training(state.store, state.article_ids(),
+                                       args.training_size)
+
+      # Validate sentences
+      if state.training is None:
+        print(f'Could not extract enough ({args.training_size}) sentences!',
+          file=sys.stderr)
+        return None
+
+    trn_sentences = pd.DataFrame({'sentence': state.training})
+
+    # Vocabulary shared by all classifiers, fit on the training set
+    featurizer    = Featurizer()
+    features_key  = featurizer.fingerprint(trn_sentences)
+    features_path = f'{model_dir}/features-{features_key[:16]}.pkl'
+
+    def model_key(cl):
+      return cl.fingerprint(trn_sentences)
+
+  # Reuse a saved model when one was trained with the same fingerprint
+  model_paths = {}
+  untrained   = []
+  with timings.stage('load_models'):
+    for cl in classifiers:
+      key = model_key(cl)
+      state.set_model_key(cl.get_name(), key)
+
+      model_path = f'{model_dir}/{cl.get_name()}-{key[:16]}.pkl'
+      model_paths[cl.get_name()] = model_path
+      if train == 'pending' and not state.pending(cl.get_name()):
         continue
+      if not cl.load(model_path):
+        untrained.append(cl)
+
+  if untrained and train != 'none' and args.stream_train:
+    print('Training classifier models on the whole corpus...')
+    with timings.stage('train', len(untrained)):
+      train_stream(untrained, lambda: training_batches(state.store,
+                   article_ids, args.train_batch_size), featurizer,
+                   args.epochs, timings=timings)
+
+      for cl in untrained:
+        if cl.is_trained():
+          cl.save(model_paths[cl.get_name()])
+        else:
+          print(f'No labeled sentences to train {cl.get_name()} on',
+                file=sys.stderr)
+    classifiers = [x for x in classifiers
+                   if x not in untrained or x.is_trained()]
+  elif untrained and train != 'none':
+    print('Training classifier models...')
+    with timings.stage('featurize_fit', len(trn_sentences)):
+      trn_features = featurizer.fit(trn_sentences)
+      featurizer.save(features_path)
+
+    model_workers = workers(args, args.model_workers)
+    with timings.stage('train', len(untrained)):
+      train_classifiers(untrained, trn_sentences, trn_features, model_workers,
+                        timings)
+      for cl in untrained:
+        cl.save(model_paths[cl.get_name()])
+
+  # How much of the training set each labeling function covers
+  if untrained and train != 'none':
+    for cl in untrained:
+      timings.log('lf_summary', label_set=cl.get_name(), lfs=cl.lf_summary)
+  elif untrained:
+    for cl in untrained:
+      print(f'No trained model for {cl.get_name()}, run train first',
+            file=sys.stderr)
+    classifiers = [x for x in classifiers if x not in untrained]
+
+  if features or any(state.pending(cl.get_name()) for cl in classifiers):
+    if not featurizer.is_fit() and not featurizer.load(features_path):
+      featurizer.fit(trn_sentences)
+      featurizer.save(features_path)
+
+  return classifiers, featurizer
+
+# Classifiers compiled into one pruned model, loaded if they were compiled
+# before with the same models and tolerance
+def compile_models(args, timings, state, classifiers, featurizer):
+  digest = hashlib.sha256(f'{COMPILED_VERSION}:{args.prune_tolerance}'
+                          .encode('utf-8'))
+  for cl in classifiers:
+    digest.update(f'{cl.get_name()}:{state.model_keys[cl.get_name()]}\0'
+                  .encode('utf-8'))
+
+  path     = (f'{args.cache_dir}/models/compiled-'
+              f'{digest.hexdigest()[:16]}.pkl')
+  compiled = CompiledModels.load(path, timings)
+  if compiled is not None:
+    return compiled
+
+  print('Compiling classifier models...')
+  with timings.stage('compile', len(classifiers)):
+    compiled = CompiledModels.compile(classifiers, featurizer,
+                                      args.prune_tolerance)
+    compiled.timings = timings
+
+  # How often pruned models still agree with the full ones
+  if state.training is not None:
+    with timings.stage('compile_check', len(state.training)):
+      compiled.check(classifiers, featurizer,
+                     pd.DataFrame({'sentence': state.training}))
+    for name, agreement in compiled.agreement.items():
+      print(f'{name} compiled agrees on {agreement:.2%} of the training set')
+
+  timings.log('compiled', features=len(compiled),
+              agreement=compiled.agreement)
+  compiled.save(path)
+
+  return compiled
+
+# Classify new articles in batches, all classifiers sharing the features of
+# each batch. With --compiled they share one pruned model instead, which
+# featurizes and classifies in the process. Returns the names of the
+# classifiers that failed
+def classify(args, timings, state, classifiers, featurizer):
+  # Models of label sets with nothing pending are not loaded, and have
+  # nothing to classify either
+  if args.compiled and any(state.pending(x.get_name()) for x in classifiers):
+    featurizer = cl_pool = compile_models(args, timings, state,
+      [x for x in classifiers if x.is_trained()], featurizer)
+  else:
+    cl_pool = ClassifierPool(classifiers, args.model_workers or 1, timings)
+
+  print('Running classifier models on new articles...')
+  with timings.stage('classify_articles'), \
+       Tagger(workers(args, args.tag_workers)) as tagger, cl_pool:
+    failed = classify_pending(state, classifiers, featurizer, args.batch_size,
+                              tagger, cl_pool, timings=timings)
+
+  save_state(args, timings, state)
+  return failed
+
+# Top terms of the selected label sets and the requested renders of them,
+# rendered once all plots are built
+def report(args, timings, state, failed=frozenset()):
+  # Articles linked to the top terms are views into the store
+  stopwords = load_stopwords(args.stopwords)
+  jobs      = []
+
+  for name in args.label_sets:
+    if name in failed:
+      continue
+    if not state.classified.get(name):
+      print(f'No articles classified with {name}, run classify first',
+            file=sys.stderr)
+      continue
 
-      # Fill this sentence's fields
-      s_dict = {}
-      s_dict['article']  = article
-      s_dict['sentence'] = sentence
+    stat_string = f'* Classified with "{name.upper()}" labels *'
+    print('*' * len(stat_string))
+    print(stat_string)
+    print('*' * len(stat_string))
 
-      sentence_rows.append(s_dict)
+    # Most frequent terms, skipping low freqs and common words
+    with timings.stage('top_terms'):
+      stats     = state.get_stats(name)
+      top_terms = stats.top_k(args.top, min_df=3, stopwords=stopwords)
+
+      print('Building relationship graph and keyword histogram...')
+      rel_graph, histo = build_plots(state, name, top_terms,
+                                     args.graph_layout)
+    print(', '.join(top_terms))
+
+    if args.shared:
+      print_shared(state, name, [x.lower() for x in args.shared])
+
+    if args.export_incidence:
+      os.makedirs(args.pngs, exist_ok=True)
+      with timings.stage('incidence', len(stats)):
+        path = f'{args.pngs}/{name}_incidence.npz'
+        state.incidence(name).save(path)
+      print(f'Incidence written to: {path}')
+
+    # Counts are written here, they need no rendering
+    if args.export_counts:
+      os.makedirs(args.pngs, exist_ok=True)
+      for fmt in args.export_counts:
+        path = histo.export(f'{args.pngs}/{name}_counts', fmt)
+        print(f'Counts written to: {path}')
+
+    if 'graph' in args.renders:
+      jobs.append(('graph', rel_graph, f'{args.pngs}/{name}'))
+    if 'histogram' in args.renders:
+      jobs.append(('histogram', histo, f'{args.pngs}/{name}_hist'))
+
+  if not jobs:
+    return
 
-  # Validate sentences
-  if len(sentence_rows) < training_set_size:
-    print(f'Could not extract enough ({training_set_size}) sentences!',
-      file=sys.stderr)
+  # Renders are independent of each other, they run in their own processes
+  os.makedirs(args.pngs, exist_ok=True)
+  render_workers = workers(args, args.render_workers)
+  print(f'Rendering {len(jobs)} plots with {render_workers} workers...')
+  with timings.stage('render', len(jobs)):
+    results = render_plots(jobs, render_workers, args.render_preset,
+                           args.render_format)
+
+  for (kind, _, _), (path, seconds, error) in zip(jobs, results):
+    timings.record(f'render/{kind}', seconds, 1)
+    if error:
+      print(f'Could not render {path}. {error}')
+    else:
+      print(f'Success rendering to: {path}')
+
+# Articles using all of the given terms, with the terms most often found
+# along with them
+def print_shared(state, name, terms):
+  incidence = state.incidence(name)
+  missing   = [x for x in terms if x not in incidence.index]
+  if missing:
+    print(f'Terms not found with {name}: {", ".join(missing)}')
     return
 
-  # Build training and full sentence sets
-  all_sentences = pd.DataFrame(sentence_rows)
-  trn_sentences = pd.DataFrame(all_sentences['sentence'].sample(
-    training_set_size, random_state=1))
-  tst_sentences = pd.DataFrame(all_sentences['sentence'])
+  shared = sorted(incidence.shared_articles(terms).tolist(),
+                  key=state.get_path)
+  print(f'{len(shared)} articles share {", ".join(terms)}:')
+  for article_id in shared:
+    print(f'  {state.get_path(article_id)}')
+
+  for term in terms:
+    related = incidence.related_terms(term, 5)
+    print(f'Most found with {term}: ' +
+          ', '.join(f'{x} ({n})' for x, n in related))
+
+def state_path(args):
+  return os.path.join(args.cache_dir, 'corpus.pkl')
+
+def load_state(args):
+  return CorpusState() if args.fresh else CorpusState.load(state_path(args))
+
+def save_state(args, timings, state):
+  with timings.stage('save_state'):
+    state.save(state_path(args))
+
+# Worker count of a stage, falling back to --workers and then to all cores
+def workers(args, stage_workers):
+  return stage_workers or args.workers or os.cpu_count()
+
+def run_ingest(args, timings):
+  return ingest(args, timings) is not None
+
+def run_train(args, timings):
+  state  = load_state(args)
+  models = prepare_models(args, timings, state, 'all')
+  if models is None:
+    return False
+
+  save_state(args, timings, state)
+  return True
+
+def run_classify(args, timings):
+  state  = load_state(args)
+  models = prepare_models(args, timings, state, 'none')
+  if models is None:
+    return False
+
+  classify(args, timings, state, *models)
+  return True
+
+def run_report(args, timings):
+  report(args, timings, load_state(args))
+  return True
+
+def run_all(args, timings):
+  state = ingest(args, timings)
+  if state is None:
+    return False
+
+  models = prepare_models(args, timings, state, 'pending')
+  if models is None:
+    return False
+
+  failed = classify(args, timings, state, *models)
+  report(args, timings, state, failed)
+  return True
+
+# Run every stage, then keep the state and models in memory to answer
+# requests. Articles added while serving go through extraction and
+# classification against the warm state, models are not retrained
+def run_serve(args, timings):
+  from service import AnalysisService, serve
+
+  state = ingest(args, timings, keep_added=True)
+  if state is None:
+    return False
+
+  # Every model is needed to classify sentences sent to the service
+  models = prepare_models(args, timings, state, 'all', features=True)
+  if models is None:
+    return False
+  classify(args, timings, state, *models)
+
+  compiled = None
+  if args.compiled:
+    compiled = compile_models(args, timings, state, *models)
+
+  # Articles sent by path are added to the corpus, a rescan only drops pdfs
+  # gone from the articles directory
+  def update(pdf_paths):
+    keep = state.records if pdf_paths is not None else added_paths(args, state)
+    if pdf_paths is None:
+      pdf_paths = scan_articles(args, timings)
+      if pdf_paths is None:
+        return None
+
+    changes = update_corpus(args, timings, state, pdf_paths, keep)
+    if changes is not None:
+      classify(args, timings, state, *models)
+    return changes
+
+  service = AnalysisService(args, timings, state, *models, update, compiled)
+  return serve(service, args.host, args.port, args.socket)
+
+commands = {
+  'ingest':   run_ingest,
+  'train':    run_train,
+  'classify': run_classify,
+  'report':   run_report,
+  'all':      run_all,
+  'serve':    run_serve,
+}
+
+def add_common_options(parser):
+  parser.add_argument('--cache-dir', default=repo_path('cache'),
+    help='where the corpus state, text cache, models and log are kept')
+  parser.add_argument('--workers', type=int, default=None,
+    help='default worker count of every stage, all cores by default')
+  parser.add_argument('--fresh', action='store_true',
+    help='ignore the saved corpus state and start over')
+  parser.add_argument('--log', default=None,
+    help='json lines log of stage timings, <cache-dir>/run.jsonl by default')
+  parser.add_argument('--profile-dir', default=None,
+    help='write a cProfile dump of every stage here')
+  parser.add_argument('--trace-memory', action='store_true',
+    help='trace allocations of every stage with tracemalloc')
+
+def add_ingest_options(parser):
+  parser.add_argument('--articles', default=repo_path('articles'),
+    help='directory of name_year.pdf articles')
+  parser.add_argument('--ingest-workers', type=int, default=None)
+  parser.add_argument('--text-cache-bytes', type=int, default=2 << 30)
+  parser.add_argument('--extractors', nargs='+', choices=list(backends),
+    default=['pdfminer', 'textract'], help='extraction backends, in order')
+  parser.add_argument('--max-pages', type=int, default=300)
+  parser.add_argument('--timeout', type=float, default=300,
+    help='seconds after which extraction of a document is cut short')
+
+def add_model_options(parser):
+  parser.add_argument('--label-sets', nargs='+',
+    choices=list(labelers.registered), default=list(labelers.registered))
+  parser.add_argument('--model-workers', type=int, default=None,
+    help='workers training models, classifying runs on this many threads '
+         'and on one by default')
+
+def add_train_options(parser):
+  parser.add_argument('--training-size', type=int, default=2000)
+  parser.add_argument('--stream-train', action='store_true',
+    help='train out of core on every filtered sentence of the corpus')
+  parser.add_argument('--train-batch-size', type=int, default=50000,
+    help='sentences per step of --stream-train')
+  parser.add_argument('--epochs', type=int, default=1,
+    help='passes over the corpus of --stream-train')
+  parser.add_argument('--hash-features', type=int, default=1 << 20,
+    help='hashed feature columns of --stream-train')
+
+def add_classify_options(parser):
+  parser.add_argument('--batch-size', type=int, default=50000,
+    help='filtered sentences classified at once')
+  parser.add_argument('--tag-workers', type=int, default=None)
+  parser.add_argument('--compiled', action='store_true',
+    help='classify with pruned models sharing a reduced vocabulary')
+  parser.add_argument('--prune-tolerance', type=float, default=1e-3,
+    help='coefficients under this fraction of a model\'s largest are pruned')
+
+def add_report_options(parser):
+  parser.add_argument('--pngs', default=repo_path('pngs'))
+  parser.add_argument('--top', type=int, default=10,
+    help='terms per label set')
+  parser.add_argument('--stopwords',
+    default=repo_path('src', 'common.txt'))
+  parser.add_argument('--renders', nargs='*', choices=renders,
+    default=list(renders), help='plots to render, none to skip rendering')
+  parser.add_argument('--no-render', dest='renders', action='store_const',
+    const=[], help='only print the top terms')
+  parser.add_argument('--render-preset', choices=list(presets), default='full',
+    help='size and resolution of the renders')
+  parser.add_argument('--render-format', choices=formats, default='png')
+  parser.add_argument('--render-workers', type=int, default=None)
+  parser.add_argument('--shared', nargs='+', default=None, metavar='TERM',
+    help='list the articles using all of these terms')
+  parser.add_argument('--export-incidence', action='store_true',
+    help='also write the term by article incidence matrix as npz')
+  parser.add_argument('--export-counts', nargs='*', choices=('csv', 'json'),
+    default=[], help='also write the histogram counts per term and year')
+  parser.add_argument('--graph-layout', choices=layouts, default='auto',
+    help='rings per term, or a network sharing article nodes between terms')
+
+def add_serve_options(parser):
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8765)
+  parser.add_argument('--socket', default=None,
+    help='serve on this Unix socket instead of over TCP')
+
+def build_parser():
+  parser      = argparse.ArgumentParser(
+    description='Classify article sentences and chart their top terms')
+  subcommands = parser.add_subparsers(dest='command', metavar='command')
+
+  options = {
+    'ingest':   [add_ingest_options],
+    'train':    [add_model_options, add_train_options],
+    'classify': [add_model_options, add_train_options, add_classify_options],
+    'report':   [add_model_options, add_report_options],
+    'all':      [add_ingest_options, add_model_options, add_train_options,
+                 add_classify_options, add_report_options],
+    'serve':    [add_ingest_options, add_model_options, add_train_options,
+                 add_classify_options, add_report_options, add_serve_options],
+  }
+  helps = {
+    'ingest':   'extract new or modified articles',
+    'train':    'train the models of the selected label sets',
+    'classify': 'classify articles not classified yet',
+    'report':   'print top terms and render their charts',
+    'all':      'run every stage, the default',
+    'serve':    'run every stage, then answer requests over http',
+  }
+
+  for name, adders in options.items():
+    command = subcommands.add_parser(name, help=helps[name])
+
+    # Options of stages a command does not run still need a value
+    command.set_defaults(ingest_workers=None, model_workers=None,
+                         tag_workers=None, render_workers=None)
+
+    add_common_options(command)
+    for add in adders:
+      add(command)
+
+  return parser
+
+def main(argv=None):
+  # Setup
+  pd.set_option('display.max_rows', None)
+  pd.set_option('display.max_colwidth', 200)
 
-  # Build classifiers for all categories
-  print('Building classifiers...')
-  classifiers = []
-  classifiers.append(Classifier(labelers.registered_software, 'software'))
-  classifiers.append(Classifier(labelers.registered_species,  'species'))
-  classifiers.append(Classifier(labelers.registered_sample,   'sample'))
-  classifiers.append(Classifier(labelers.registered_method,   'method'))
-  classifiers.append(Classifier(labelers.registered_molecule, 'molecule'))
-  classifiers.append(Classifier(labelers.registered_property, 'property'))
-
-  # Train all classifiers on the given data
-  print('Training classifier models...')
-  for i, cl in enumerate(classifiers):
-    cl.train(trn_sentences)
-    print(f'{i + 1} / {len(classifiers)}...')
-
-  # Run all classifiers on full data
-  print('Running classifier models on full corpus...')
-  for cl in classifiers:
-    try:
-      predictions = cl.classify(tst_sentences)
-    except RuntimeError as e:
-      print(e, file=sys.stderr)
-      continue
+  # Without a command every stage is run
+  if argv is None:
+    argv = sys.argv[1:]
+  if not argv or argv[0] not in commands and argv[0] not in ('-h', '--help'):
+    argv = ['all'] + list(argv)
+  args = build_parser().parse_args(argv)
 
-    stat_string = f'* Classified with "{cl.get_name().upper()}" labels *'
-    print('*' * len(stat_string))
-    print(stat_string)
-    print('*' * len(stat_string))
+  # Stage timings, counts and memory go to a json lines log
+  log_path = args.log or os.path.join(args.cache_dir, 'run.jsonl')
+  timings  = Timings(log_path, args.profile_dir, args.trace_memory)
+
+  ok = commands[args.command](args, timings)
+
+  timings.log('summary', command=args.command, stages=timings.report())
+  print(f'Stage timings written to: {log_path}')
 
-    # Add predictions to article
-    for prediction, article in zip(predictions, all_sentences['article']):
-      article.add_prediction(prediction)
-
-    # Get most used terms for CLASS predictions
-    all_dicts     = []
-    filtered_tags = ('DT', 'IN', 'CC', 'EX', 'TO', 'WDT', 'PRP',
-                    'VBG', 'CD', 'WRB', 'MD', 'VBZ', 'RP', 'SYM',
-                    'UH', 'PRP', 'PRP$', 'RB', 'RBS', 'WP', 'VB')
-    for article in articles:
-      curr_dict = {}
-
-      for sentence, prediction in \
-      zip(article.get_sentences(), article.get_predictions()):
-        if prediction != 0:
-          continue
-
-        filtered_sentence = re.sub(r'[^\w\s]', '', sentence.lower(), re.UNICODE)
-        toks = nltk.word_tokenize(filtered_sentence)
-        tags = [x[1] for x in nltk.pos_tag(toks)]
-
-        # Walk over sentence with two word sliding window
-        for i in range(len(toks) - 1):
-          w0           = toks[i]
-          w1           = toks[i + 1]
-          compound     = f'{w0} {w1}'
-
-          # Skip over useless tags
-          if (tags[i] in filtered_tags or
-              (len(w0) == 1 and w0 in string.punctuation)):
-            continue
-
-          # Add single word
-          count         = curr_dict.get(w0, 0) + 1
-          curr_dict[w0] = count
-
-          # Skip over useless tags
-          if (tags[i + 1] in filtered_tags or
-              (len(w1) == 1 and w1 in string.punctuation)):
-            continue
-
-          # Add two words
-          count               = curr_dict.get(compound, 0) + 1
-          curr_dict[compound] = count
-
-      all_dicts.append((article, curr_dict))
-
-      # Clean the predictions for next iteration
-      article.clean_predictions()
-
-    # Merge dictionaries
-    main_dict = {}
-    for article, d in all_dicts:
-      for key in d.keys():
-        main_get   = main_dict.get(key, (0, list()))
-        main_count = main_get[0] + 1
-        main_list  = main_get[1]
-        main_list.append(article)
-
-        main_dict[key] = (main_count, main_list)
-
-    # Filter low freqs and sort by freq
-    main_dict = dict(filter(lambda x: x[1][0] > 2, main_dict.items()))
-    main_dict_ordered_keys = sorted(main_dict.keys(),
-                                    key=lambda x: main_dict.get(x)[0],
-                                    reverse=True)
-
-    # Update top_choices if there are less available choices
-    with open('common.txt', 'r') as c:
-      common = c.readlines()
-
-    for w in common:
-      w = w.strip()
-      if w in main_dict_ordered_keys:
-        main_dict_ordered_keys.remove(w)
-
-    top_choices = min(top_choices, len(main_dict_ordered_keys))
-
-    print('Building relationship graph and keyword histogram...')
-    rel_graph = RelGraph(cl.get_name().upper())
-    histo = Histogram(cl.get_name().upper())
-
-    for i, k in enumerate(main_dict_ordered_keys[:top_choices]):
-      article_list = main_dict.get(k)[1]
-      rel_graph.link_concept(k.upper(), article_list)
-      histo.count_concept(k.upper(), article_list)
-
-    try:
-      print('Rendering graph...')
-      rel_graph.cairo_render(f'{png_dir}/{cl.get_name()}', 2160)
-      print(f'Success rendering to: {png_dir}/{cl.get_name()}.png')
-
-      print('Rendering histogram...')
-      histo.plot(f'{png_dir}/{cl.get_name()}_hist')
-      print(f'Success rendering to: {png_dir}/{cl.get_name()}_hist.png')
-    except Exception as e:
-      print(f'Could not render. {repr(e)}')
+  return 0 if ok else 1
 
 if __name__ == "__main__":
-  main()
+  sys.exit(main())
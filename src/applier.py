@@ -0,0 +1,74 @@
+import numpy as np
+
+# Sentence column handed to batch labeler functions. Lowercasing and keyword
+# lookups are computed once and shared by every labeler function applied
+class SentenceBatch:
+  def __init__(self, sentences):
+    self.sentences = sentences.reset_index(drop=True)
+    self.lowered   = None
+    self.matches   = {}
+    self.found     = {}
+
+  def __len__(self):
+    return len(self.sentences)
+
+  def get_lowered(self):
+    if self.lowered is None:
+      self.lowered = self.sentences.str.lower()
+
+    return self.lowered
+
+  # Boolean mask of the sentences containing a keyword. If the keyword is
+  # registered in a labelers.KeywordMatcher, the mask comes from a single
+  # pass of the matcher shared by every keyword asked about
+  def contains(self, keyword, lower=True, matcher=None):
+    key = (keyword, lower)
+    if key in self.matches:
+      return self.matches[key]
+
+    if matcher and keyword in matcher.keywords:
+      found = self.find(matcher, lower)
+      mask  = np.zeros(len(self), dtype=bool)
+      mask[found.get(keyword, [])] = True
+    else:
+      column = self.get_lowered() if lower else self.sentences
+      mask   = column.str.contains(keyword, regex=False).to_numpy()
+
+    self.matches[key] = mask
+    return mask
+
+  # Rows where each of the matcher's keywords was found
+  def find(self, matcher, lower=True):
+    key = (id(matcher), lower)
+    if key not in self.found:
+      found = {}
+      for i, sentence in enumerate(self.sentences):
+        for keyword in matcher.find(sentence, lower):
+          found.setdefault(keyword, []).append(i)
+      self.found[key] = found
+
+    return self.found[key]
+
+# Drop-in replacement for snorkel's PandasLFApplier. Labeler functions with a
+# batch_f attribute label the whole sentence column in one vectorized call,
+# the rest are called once per row like snorkel does
+class BatchLFApplier:
+  def __init__(self, lfs):
+    self.lfs = lfs
+
+  def apply(self, df):
+    batch = SentenceBatch(df.sentence)
+    rows  = None
+    L     = np.full((len(df), len(self.lfs)), -1, dtype=int)
+
+    for j, lf in enumerate(self.lfs):
+      batch_f = getattr(lf, 'batch_f', None)
+      if batch_f:
+        L[:, j] = batch_f(batch)
+        continue
+
+      if rows is None:
+        rows = list(df.itertuples(index=False))
+      L[:, j] = [lf(x) for x in rows]
+
+    return L
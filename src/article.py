@@ -1,56 +1,67 @@
 import os
-import textract
 
-from nltk import tokenize
+from extract import Extractor
 
-class Article:
-  article_counter = 0
+# Name and year of an article from its 'name_year.pdf' file name
+def parse_path(path):
+  path_toks = os.path.basename(path).split('_')
+  year      = int(path_toks[-1].split('.')[0])
+  name      = ' '.join(path_toks[:-1])
+
+  return name, year
 
-  def __init__(self, path):
+# Sentences of a pdf, reusing a previous extraction of the same file
+# contents if a TextCache is given. Documents cut short by the
+# extractor timeout are not cached
+def extract_text(path, cache=None, extractor=None):
+  if not os.path.isfile(path):
+    raise FileNotFoundError
+  if extractor is None:
+    extractor = Extractor()
 
-    if not os.path.isfile(path):
-      raise FileNotFoundError
+  cache_key = None
+  if cache:
+    cache_key = cache.key(path, extractor.fingerprint())
+    entry     = cache.get(cache_key)
+    if entry is not None:
+      return entry
 
+  _, sentences, complete = extractor.extract(path)
 
-    path_toks = os.path.basename(path).split('_')
-    self.path = path
-    self.year = int(path_toks[-1].split('.')[0])
-    self.name = ' '.join(path_toks[:-1])
+  if cache and complete:
+    cache.put(cache_key, sentences)
 
-    self.raw_text    = textract.process(self.path).decode('utf-8')
-    self.predictions = []
+  return sentences
 
-    self.sentences = tokenize.sent_tokenize(self.raw_text.replace('\n', ' '))
-    self.sentences = [x.strip() for x in self.sentences]
+# View of one article of a SentenceStore, its sentences and predictions are
+# columns of the store so an Article holds nothing but its id
+class Article:
+  __slots__ = ('store', 'id')
 
-    self.id = Article.article_counter
-    Article.article_counter += 1
+  def __init__(self, store, article_id):
+    self.store = store
+    self.id    = article_id
 
   def get_name(self):
-    return self.name
+    return self.store.get_name(self.id)
 
   def get_year(self):
-    return self.year
+    return self.store.get_year(self.id)
 
   def get_id(self):
     return self.id
 
-  def get_text(self):
-    return self.raw_text
+  def get_path(self):
+    return self.store.get_path(self.id)
 
   def get_sentences(self):
-    return self.sentences
-
-  def clean_predictions(self):
-    self.predictions = []
-
-  def add_prediction(self, prediction):
-    self.predictions.append(prediction)
+    return self.store.sentences(self.store.article_rows(self.id))
 
-  def get_predictions(self):
-    return self.predictions
+  # Predictions of a classifier for the filtered sentences of this article
+  def get_predictions(self, name):
+    return self.store.get_predictions(name, self.store.kept_rows(self.id))
 
   def write_text(self, path):
     with open(path, 'w') as out:
-      for line in self.sentences:
+      for line in self.get_sentences():
         out.write(f'{line}\n')
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import random
+import argparse
+import platform
+import tempfile
+import warnings
+import pandas as pd
+
+import labelers
+from article    import extract_text
+from extract    import Extractor
+from corpus     import CorpusState
+from classifier import build_classifier, train_classifiers, ClassifierPool
+from applier    import BatchLFApplier
+from features   import Featurizer
+from pipeline   import draw_training, classify_pending, build_plots
+from tagger     import Tagger
+from timing     import Timings, peak_rss
+from render     import render_plot
+from files      import repo_path
+
+# Bump whenever the layout of the report changes
+REPORT_VERSION = 2
+
+# Words synthetic sentences are drawn from, one list per topic. Each topic
+# hits the keywords of some labeling functions, the last one hits none
+topics = [
+  'the BWA software version package script GATK tool pipeline aligner'.split(),
+  'the strain species Bacterium Mycobacterium isolate lineage'.split(),
+  'the sample genome MS2341 individual bone tooth specimen'.split(),
+  'the enrichment fold method capture combine technique protocol'.split(),
+  'the aDNA DNA RNA molecule fragment extract library'.split(),
+  'the clonal gc content hybrid bias duplication length rate'.split(),
+  'we then observed that results were quite interesting and good'.split(),
+]
+
+# Sentences the filter drops, repeated on every page like headers
+boilerplate = [
+  'Copyright license doi 10.1000/xyz123 all rights reserved.',
+  'Smith et al. reported similar findings in 2012.',
+]
+
+def synthetic_sentence(rng):
+  words    = rng.choice(topics)
+  sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(5, 15)))
+
+  return f'{sentence[0].upper()}{sentence[1:]}.'
+
+# Write n synthetic articles as already extracted 'name_year.txt' files of
+# form feed separated pages, returns their paths
+def synthetic_corpus(corpus_dir, n, sentences, seed=0, page_size=40):
+  rng   = random.Random(seed)
+  paths = []
+  os.makedirs(corpus_dir, exist_ok=True)
+
+  for i in range(n):
+    path = os.path.join(corpus_dir, f'author{i}_{2008 + i % 13}.txt')
+    text = [synthetic_sentence(rng) for _ in range(sentences)]
+
+    pages = []
+    for j in range(0, len(text), page_size):
+      pages.append('\n'.join(boilerplate[:1] + text[j:j + page_size] +
+                             boilerplate[1:]))
+
+    with open(path, 'w', encoding='utf-8') as f:
+      f.write('\f'.join(pages))
+    paths.append(path)
+
+  return paths
+
+# Run every stage of the pipeline on n synthetic articles, returns the run's
+# report. Articles and plots are written under work_dir
+def run(work_dir, n, sentences=300, workers=1, seed=0, training_set_size=2000,
+        top_choices=10, batch_size=50000):
+  timings = Timings()
+  paths   = synthetic_corpus(os.path.join(work_dir, f'articles-{n}'), n,
+                             sentences, seed)
+  png_dir = os.path.join(work_dir, f'pngs-{n}')
+  os.makedirs(png_dir, exist_ok=True)
+
+  # Extraction and filtering, one article at a time
+  state     = CorpusState()
+  extractor = Extractor(('text',))
+  total     = 0
+  for path in paths:
+    with timings.stage('extract', 1):
+      article_sentences = extract_text(path, None, extractor)
+    with timings.stage('filter', len(article_sentences)):
+      keep = [labelers.simple_filter(x) for x in article_sentences]
+
+    state.add_article(path, article_sentences, keep)
+    total += len(article_sentences)
+
+  with timings.stage('draw_training'):
+    training = draw_training(state.store, state.article_ids(),
+                             training_set_size)
+  if training is None:
+    raise ValueError(f'Not enough sentences in {n} articles for '
+                     f'{training_set_size} training sentences, lower '
+                     '--training-size or raise --sentences')
+  trn_sentences = pd.DataFrame({'sentence': training})
+
+  classifiers = [build_classifier(x) for x in labelers.registered]
+  for cl in classifiers:
+    state.set_model_key(cl.get_name(), cl.fingerprint(trn_sentences))
+
+  # Labeling functions alone, train() applies them again
+  for cl in classifiers:
+    with timings.stage('lf_apply', len(trn_sentences)):
+      with warnings.catch_warnings():
+        warnings.filterwarnings('ignore')
+        BatchLFApplier(cl.lfs).apply(df=trn_sentences)
+
+  featurizer = Featurizer()
+  with timings.stage('featurize_fit', len(trn_sentences)):
+    trn_features = featurizer.fit(trn_sentences)
+  with timings.stage('train', len(classifiers)):
+    train_classifiers(classifiers, trn_sentences, trn_features, workers,
+                      timings)
+
+  with Tagger(workers) as tagger, \
+       ClassifierPool(classifiers, workers, timings) as cl_pool:
+    classify_pending(state, classifiers, featurizer, batch_size, tagger,
+                     cl_pool, timings=timings)
+
+  for cl in classifiers:
+    with timings.stage('top_terms'):
+      top_terms = state.get_stats(cl.get_name()).top_k(top_choices)
+      rel_graph, histo = build_plots(state, cl.get_name(), top_terms)
+
+    # A render that failed would pass for a fast one
+    for kind, plot, name in (('graph', rel_graph, cl.get_name()),
+                             ('histogram', histo, f'{cl.get_name()}_hist')):
+      with timings.stage(f'render_{kind}', 1):
+        _, _, error = render_plot((kind, plot, os.path.join(png_dir, name)))
+      if error:
+        raise RuntimeError(f'Could not render {kind} of {cl.get_name()}. '
+                           f'{error}')
+
+  report = {
+    'articles':  n,
+    'sentences': total,
+    'kept':      int(state.store.keep.sum()),
+    'seconds':   sum(v['seconds'] for k, v in timings.stages.items()
+                     if '/' not in k),
+    'peak_rss':  peak_rss(),
+    'stages':    timings.report(),
+  }
+
+  return report
+
+# Stages, and whole runs by peak RSS, slower or bigger than in the baseline
+# by more than tolerance. Differences under min_seconds are ignored as noise
+def compare(report, baseline, tolerance=0.25, min_seconds=0.05):
+  regressions = []
+  for scale, current in report['runs'].items():
+    previous = baseline.get('runs', {}).get(scale)
+    if previous is None:
+      continue
+
+    for name, stage in current['stages'].items():
+      before = previous['stages'].get(name)
+      if before is None:
+        continue
+
+      if (stage['seconds'] > before['seconds'] * (1 + tolerance) and
+          stage['seconds'] - before['seconds'] > min_seconds):
+        regressions.append((scale, name, 'seconds', before['seconds'],
+                            stage['seconds']))
+
+    if current['peak_rss'] > previous['peak_rss'] * (1 + tolerance):
+      regressions.append((scale, 'run', 'peak_rss', previous['peak_rss'],
+                          current['peak_rss']))
+
+  return regressions
+
+def print_report(report):
+  for scale, current in report['runs'].items():
+    print(f'{scale} articles, {current["sentences"]} sentences, '
+          f'{current["seconds"]:.2f}s, '
+          f'peak RSS {current["peak_rss"] / (1 << 20):.0f} MiB')
+
+    for name, stage in current['stages'].items():
+      print(f'  {name:<18} {stage["seconds"]:>9.3f}s '
+            f'{stage["throughput"]:>12.1f}/s')
+
+def main():
+  parser = argparse.ArgumentParser(
+    description='Time every pipeline stage on synthetic corpora')
+  parser.add_argument('--scales', type=int, nargs='+', default=[100],
+    help='numbers of articles to run with, e.g. 100 1000 10000')
+  parser.add_argument('--sentences', type=int, default=300,
+    help='sentences per article')
+  parser.add_argument('--training-size', type=int, default=2000)
+  parser.add_argument('--workers', type=int, default=1)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--work-dir', default=None,
+    help='where articles and plots are written, a temp dir by default')
+  parser.add_argument('--out', default=repo_path('bench', 'report.json'))
+  parser.add_argument('--baseline', default=None,
+    help='report to compare against, exits with 1 on regressions')
+  parser.add_argument('--tolerance', type=float, default=0.25)
+  args = parser.parse_args()
+
+  report = {
+    'version':       REPORT_VERSION,
+    'python':        platform.python_version(),
+    'platform':      platform.platform(),
+    'workers':       args.workers,
+    'sentences':     args.sentences,
+    'training_size': args.training_size,
+    'runs':          {},
+  }
+
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    work_dir = args.work_dir or tmp_dir
+    for n in args.scales:
+      print(f'Benchmarking {n} articles...')
+      try:
+        report['runs'][str(n)] = run(work_dir, n, args.sentences,
+                                     args.workers, args.seed,
+                                     args.training_size)
+      except (ValueError, RuntimeError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+  print_report(report)
+
+  out_dir = os.path.dirname(args.out) or '.'
+  os.makedirs(out_dir, exist_ok=True)
+  with open(args.out, 'w') as f:
+    json.dump(report, f, indent=2)
+  print(f'Report written to: {args.out}')
+
+  if args.baseline:
+    with open(args.baseline, 'r') as f:
+      baseline = json.load(f)
+
+    regressions = compare(report, baseline, args.tolerance)
+    for scale, name, metric, before, after in regressions:
+      print(f'Regression at {scale} articles in {name} {metric}: '
+            f'{before:.3f} -> {after:.3f}', file=sys.stderr)
+    if regressions:
+      sys.exit(1)
+
+if __name__ == "__main__":
+  main()
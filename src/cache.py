@@ -0,0 +1,114 @@
+import os
+import hashlib
+import pickle
+import nltk
+
+from files import atomic_write
+
+# Bump whenever extract_text changes how sentences are produced or cached, so
+# entries written by an older extractor are never served again
+EXTRACTOR_VERSION = 3
+
+tokenizer_digest = None
+
+# Hex sha256 of a file's contents, optionally salted with a prefix
+def file_digest(path, prefix=b''):
+  digest = hashlib.sha256(prefix)
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      digest.update(block)
+
+  return digest.hexdigest()
+
+# Fingerprint of the NLTK sentence tokenizer, a new NLTK release or a
+# re-downloaded punkt model produces a different fingerprint
+def tokenizer_fingerprint():
+  global tokenizer_digest
+
+  if tokenizer_digest is None:
+    digest = hashlib.sha256(nltk.__version__.encode('utf-8'))
+    with nltk.data.find('tokenizers/punkt/english.pickle').open() as model:
+      for block in iter(lambda: model.read(1 << 20), b''):
+        digest.update(block)
+    tokenizer_digest = digest.hexdigest()
+
+  return tokenizer_digest
+
+# On-disk cache of the sentences of extracted articles, keyed by file
+# content, extractor version and tokenizer. Entries are evicted least
+# recently used first once the cache grows over max_bytes
+class TextCache:
+  def __init__(self, cache_dir, max_bytes=2 << 30):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+
+    os.makedirs(self.cache_dir, exist_ok=True)
+
+  # Key of a file's entry, salt tells apart extractor configurations
+  def key(self, path, salt=''):
+    prefix = f'{EXTRACTOR_VERSION}:{salt}:{tokenizer_fingerprint()}:'
+    prefix = prefix.encode('utf-8')
+    return file_digest(path, prefix)
+
+  def entry_path(self, key):
+    return os.path.join(self.cache_dir, f'{key}.pkl')
+
+  def get(self, key):
+    entry_path = self.entry_path(key)
+    try:
+      with open(entry_path, 'rb') as f:
+        entry = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+      return None
+
+    # Touch the entry so eviction sees it as recently used
+    try:
+      os.utime(entry_path)
+    except OSError:
+      pass
+
+    return entry
+
+  def put(self, key, sentences):
+    # A failed write only costs a later extraction
+    try:
+      atomic_write(self.entry_path(key), lambda f: pickle.dump(
+        sentences, f, protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError:
+      pass
+
+  def entries(self):
+    entries = []
+    for name in os.listdir(self.cache_dir):
+      if not name.endswith('.pkl'):
+        continue
+
+      try:
+        stat = os.stat(os.path.join(self.cache_dir, name))
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, name))
+
+    return entries
+
+  # Remove least recently used entries until the cache fits in max_bytes
+  def evict(self):
+    entries    = sorted(self.entries())
+    total_size = sum(x[1] for x in entries)
+
+    for _, size, name in entries:
+      if total_size <= self.max_bytes:
+        break
+
+      try:
+        os.remove(os.path.join(self.cache_dir, name))
+      except OSError:
+        continue
+      total_size -= size
+
+  def clear(self):
+    for _, _, name in self.entries():
+      try:
+        os.remove(os.path.join(self.cache_dir, name))
+      except OSError:
+        pass
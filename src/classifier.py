@@ -1,42 +1,141 @@
+import time
+import pickle
+import hashlib
+import inspect
 import warnings
+import numpy as np
+from concurrent.futures              import (ProcessPoolExecutor,
+                                             ThreadPoolExecutor)
 from snorkel.utils                   import probs_to_preds
-from snorkel.labeling                import PandasLFApplier
 from snorkel.labeling                import LFAnalysis
-from snorkel.labeling                import filter_unlabeled_dataframe
 from snorkel.labeling.model          import LabelModel
 from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.linear_model            import LogisticRegression
+from sklearn.linear_model            import LogisticRegression, SGDClassifier
+
+import labelers
+from applier import BatchLFApplier
+from timing  import Timings
+from files   import atomic_write
+
+# Bump whenever train() changes in a way that invalidates saved models
+MODEL_VERSION = 2
 
 class Classifier:
   def __init__(self, lfs, name):
-    self.lfs        = lfs
-    self.model      = None
-    self.vectorizer = None
-    self.name       = name
+    self.lfs         = lfs
+    self.label_model = None
+    self.model       = None
+    self.vectorizer  = None
+    self.name        = name
+    self.lf_summary  = None
 
   def get_name(self):
     return self.name
 
-  def train(self, dataset):
-    # Apply labeler functions to training set
-    lfs_applier = PandasLFApplier(lfs=self.lfs)
+  def is_trained(self):
+    return self.model is not None
+
+  # Fitted (label model, vectorizer, model), what save() writes
+  def get_models(self):
+    return (self.label_model, self.vectorizer, self.model)
+
+  def set_models(self, models):
+    self.label_model, self.vectorizer, self.model = models
+
+  # Hash of the labeling functions' names, code and resources, what every
+  # model of the classifier depends on
+  def lf_digest(self):
+    digest = hashlib.sha256(f'{MODEL_VERSION}:{self.name}'.encode('utf-8'))
+
+    for lf in self.lfs:
+      try:
+        source = inspect.getsource(lf._f)
+      except (OSError, TypeError):
+        source = ''
+
+      resources = sorted((k, repr(v)) for k, v in lf._resources.items())
+      digest.update(f'{lf.name}:{source}:{resources}\0'.encode('utf-8'))
+
+    return digest
+
+  # Hash of everything train() depends on: the labeling functions and the
+  # sentences of the training set
+  def fingerprint(self, dataset):
+    digest = self.lf_digest()
+
+    for sentence in dataset.sentence:
+      digest.update(sentence.encode('utf-8'))
+      digest.update(b'\0')
+
+    return digest.hexdigest()
+
+  # Hash of everything train_stream() depends on: the labeling functions,
+  # the featurization, the training parameters and a digest of the corpus
+  def stream_fingerprint(self, corpus_digest, features_key, params):
+    digest = self.lf_digest()
+    digest.update(f'stream:{features_key}:{params}:{corpus_digest}'
+                  .encode('utf-8'))
+
+    return digest.hexdigest()
+
+  def save(self, path):
+    atomic_write(path, lambda f: pickle.dump(
+      self.get_models(), f, protocol=pickle.HIGHEST_PROTOCOL))
+
+  # Load a model saved with save(), returns False if there is none usable
+  def load(self, path):
+    try:
+      with open(path, 'rb') as f:
+        self.set_models(pickle.load(f))
+    except FileNotFoundError:
+      return False
+    except (OSError, EOFError, AttributeError, ImportError, ValueError,
+            pickle.UnpicklingError) as e:
+      print(f'Could not load model {path}. {repr(e)}')
+      return False
+
+    return True
+
+  # Labeling function outputs for every sentence of the dataset
+  def label(self, dataset):
+    lfs_applier = BatchLFApplier(lfs=self.lfs)
     with warnings.catch_warnings():
       warnings.filterwarnings('ignore')
-      lfs_train = lfs_applier.apply(df=dataset)
+      return lfs_applier.apply(df=dataset)
+
+  # Build the probabilistic label model, and the LF summary, from the
+  # labeling function outputs
+  def fit_label_model(self, lfs_train):
+    # Coverage, overlaps and conflicts of each labeling function
+    self.lf_summary = lf_summary(lfs_train, self.lfs)
+
+    self.label_model = LabelModel(cardinality=3, verbose=True)
+    self.label_model.fit(L_train=lfs_train, n_epochs=500, log_freq=100,
+      seed=42)
+
+  # Rows of a shared feature matrix for the dataset can be given, otherwise
+  # the classifier fits its own vectorizer
+  def train(self, dataset, features=None):
+    # Apply labeler functions to training set
+    lfs_train = self.label(dataset)
 
     # Build probabilistic label model
-    label_model = LabelModel(cardinality=3, verbose=True)
-    label_model.fit(L_train=lfs_train, n_epochs=500, log_freq=100, seed=42)
-    label_probs = label_model.predict_proba(lfs_train)
+    self.fit_label_model(lfs_train)
+    label_probs = self.label_model.predict_proba(lfs_train)
 
     # Filter unlabeled data points
-    df_filtered, probs_filtered = filter_unlabeled_dataframe(
-      X=dataset, y=label_probs, L=lfs_train)
+    labeled        = (lfs_train != -1).any(axis=1)
+    df_filtered    = dataset[labeled]
+    probs_filtered = label_probs[labeled]
 
     # Featurize data using scikit
-    self.vectorizer = CountVectorizer(ngram_range=(1, 5))
-    dataset_train   = self.vectorizer.fit_transform(
-                        df_filtered.sentence.tolist())
+    if features is None:
+      self.vectorizer = CountVectorizer(ngram_range=(1, 5))
+      dataset_train   = self.vectorizer.fit_transform(
+                          df_filtered.sentence.tolist())
+    else:
+      self.vectorizer = None
+      dataset_train   = features[labeled]
 
     # Replace probabilistic labels with most likely label
     preds_filtered = probs_to_preds(probs=probs_filtered)
@@ -46,12 +145,194 @@ class Classifier:
       multi_class='auto')
     self.model.fit(X=dataset_train, y=preds_filtered)
 
-  def classify(self, dataset):
-    if not self.model or not self.vectorizer:
+  # One step of out-of-core training on a batch of shared features and its
+  # labeling function outputs, once the label model is fit. Labeled rows
+  # are shuffled with rng, returns how many there were
+  def partial_fit(self, features, lfs_batch, rng):
+    labeled = np.flatnonzero((lfs_batch != -1).any(axis=1))
+    if not len(labeled):
+      return 0
+
+    preds = probs_to_preds(
+      probs=self.label_model.predict_proba(lfs_batch[labeled]))
+    order = rng.permutation(len(labeled))
+
+    # Linear model fit by stochastic gradient descent, a batch at a time
+    if self.model is None:
+      self.vectorizer = None
+      self.model      = SGDClassifier(loss='modified_huber', random_state=42)
+    self.model.partial_fit(features[labeled[order]], preds[order],
+                           classes=np.arange(3))
+
+    return len(labeled)
+
+  # Classifiers trained on shared features must be given the dataset's rows
+  # of the same featurization
+  def classify(self, dataset, features=None):
+    if not self.model:
       raise RuntimeError('Classifier has not been trained')
 
     # Featurize data
-    dataset_feat = self.vectorizer.transform(dataset.sentence.tolist())
+    if features is not None:
+      dataset_feat = features
+    elif self.vectorizer:
+      dataset_feat = self.vectorizer.transform(dataset.sentence.tolist())
+    else:
+      raise RuntimeError('Classifier was trained on shared features')
 
     # Run model on featurized data
     return self.model.predict(dataset_feat)
+
+# Per labeling function fraction of sentences it labels, labels along with
+# another function, and labels differently from another one
+def lf_summary(L, lfs):
+  summary = LFAnalysis(L=L, lfs=lfs).lf_summary()
+
+  return {lf: {'coverage':  float(row['Coverage']),
+               'overlaps':  float(row['Overlaps']),
+               'conflicts': float(row['Conflicts'])}
+          for lf, row in summary.iterrows()}
+
+# Build the classifier of a registered label set. Worker processes rebuild
+# classifiers by name since labeling functions do not pickle
+def build_classifier(name):
+  return Classifier(labelers.registered[name], name)
+
+# Train a classifier of a registered label set, returns its models, LF
+# summary and training time
+def train_label_set(name, dataset, features):
+  start = time.perf_counter()
+  cl    = build_classifier(name)
+  cl.train(dataset, features)
+
+  return cl.get_models(), cl.lf_summary, time.perf_counter() - start
+
+# Train classifiers concurrently in a process pool when workers > 1, the
+# fitted models are set back on the classifiers in the given order. The
+# training time of each classifier goes to the given Timings
+def train_classifiers(classifiers, dataset, features=None, workers=1,
+                      timings=None):
+  if not workers or workers <= 1 or len(classifiers) <= 1:
+    results = (train_label_set(cl.get_name(), dataset, features)
+               for cl in classifiers)
+    set_trained(classifiers, results, len(dataset), timings)
+    return
+
+  with ProcessPoolExecutor(max_workers=min(workers, len(classifiers))) as pool:
+    futures = [pool.submit(train_label_set, cl.get_name(), dataset, features)
+               for cl in classifiers]
+    set_trained(classifiers, (x.result() for x in futures), len(dataset),
+                timings)
+
+def set_trained(classifiers, results, size, timings=None):
+  for i, (cl, (models, summary, seconds)) in enumerate(
+      zip(classifiers, results)):
+    cl.set_models(models)
+    cl.lf_summary = summary
+    if timings:
+      timings.record(f'train/{cl.get_name()}', seconds, size)
+    print(f'{i + 1} / {len(classifiers)}...')
+
+# Out-of-core training of classifiers on a stream of sentence batches.
+# batches() must return the same DataFrames in the same order every time
+# it is called. A first pass keeps only the labeling function outputs, a
+# byte per sentence and function, and label models are fit on up to
+# label_sample rows of them. Every later pass featurizes each batch once
+# for all classifiers and takes a partial_fit step per classifier, so
+# memory is bounded by a batch and time grows linearly with the corpus.
+# Returns the number of sentences streamed, models are left untrained when
+# there are none
+def train_stream(classifiers, batches, featurizer, epochs=1,
+                 label_sample=1000000, seed=42, timings=None):
+  if timings is None:
+    timings = Timings()
+  for cl in classifiers:
+    cl.model = None
+
+  outputs = {cl.get_name(): [] for cl in classifiers}
+  total   = 0
+  for batch in batches():
+    for cl in classifiers:
+      with timings.stage('train/label', len(batch)):
+        outputs[cl.get_name()].append(cl.label(batch).astype(np.int8))
+    total += len(batch)
+  if total == 0:
+    return total
+
+  rng = np.random.RandomState(seed)
+  for cl in classifiers:
+    with timings.stage('train/label_model', total):
+      lfs_train = np.concatenate(outputs[cl.get_name()])
+      if len(lfs_train) > label_sample:
+        lfs_train = lfs_train[np.sort(
+          rng.choice(len(lfs_train), label_sample, replace=False))]
+      cl.fit_label_model(lfs_train.astype(np.int64))
+
+  for epoch in range(epochs):
+    for i, batch in enumerate(batches()):
+      with timings.stage('train/featurize', len(batch)):
+        features = featurizer.transform(batch)
+
+      for cl in classifiers:
+        start   = time.perf_counter()
+        labeled = cl.partial_fit(features, outputs[cl.get_name()][i], rng)
+        timings.record(f'train/{cl.get_name()}', time.perf_counter() - start,
+                       labeled)
+
+    print(f'Epoch {epoch + 1} / {epochs}...')
+
+  return total
+
+# Predictions of a classifier and the time they took, or the RuntimeError
+# it raised
+def classify_label_set(cl, features):
+  start = time.perf_counter()
+  try:
+    predictions = cl.classify(None, features)
+  except RuntimeError as e:
+    return e, 0.0
+  return predictions, time.perf_counter() - start
+
+# Runs trained classifiers on shared features, concurrently in a thread pool
+# when workers > 1. Models stay in this process, predicting is a sparse
+# product that releases the GIL, and handing features to worker processes
+# would cost more than the product itself. The classification time of each
+# classifier goes to the given Timings
+class ClassifierPool:
+  def __init__(self, classifiers, workers=1, timings=None):
+    self.classifiers = {cl.get_name(): cl for cl in classifiers}
+    self.workers     = workers or 1
+    self.timings     = timings
+    self.pool        = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    if self.pool:
+      self.pool.shutdown()
+      self.pool = None
+
+  # Predictions for every (name, rows) job over the given rows of features,
+  # in job order. A job whose classifier failed gets the RuntimeError it
+  # raised instead
+  def classify(self, features, jobs):
+    jobs = [(self.classifiers[name], features[rows]) for name, rows in jobs]
+    if self.workers <= 1 or len(jobs) <= 1:
+      results = [classify_label_set(cl, x) for cl, x in jobs]
+    else:
+      if self.pool is None:
+        self.pool = ThreadPoolExecutor(max_workers=self.workers)
+      results = list(self.pool.map(classify_label_set, *zip(*jobs)))
+
+    for (cl, features), (predictions, seconds) in zip(jobs, results):
+      if not isinstance(predictions, RuntimeError):
+        self.record(cl.get_name(), seconds, features.shape[0])
+    return [predictions for predictions, _ in results]
+
+  def record(self, name, seconds, items):
+    if self.timings:
+      self.timings.record(f'classify/{name}', seconds, items)
@@ -0,0 +1,188 @@
+import time
+import pickle
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+
+from files import atomic_write
+
+# Bump whenever compile() changes in a way that invalidates saved models
+COMPILED_VERSION = 1
+
+# Linear models of several classifiers compiled for inference. Coefficients
+# under tolerance times a model's largest one are pruned, and features no
+# model still uses are dropped from the vocabulary. All classifiers score a
+# batch with one sparse by dense product over the surviving features. Works
+# as both the featurizer and the ClassifierPool of classify_pending
+class CompiledModels:
+  def __init__(self, vectorizer, columns, weights, intercepts, classes,
+               spans, timings=None):
+    self.vectorizer = vectorizer
+    self.columns    = columns
+    self.weights    = weights
+    self.intercepts = intercepts
+    self.classes    = classes
+    self.spans      = spans
+    self.timings    = timings
+    self.agreement  = {}
+    self.analyzer   = None
+    self.index      = None
+
+  # Compile trained classifiers sharing a featurizer, a Featurizer or a
+  # HashingFeaturizer. A restricted vocabulary replaces a fitted one, while
+  # hashed features keep their hashing and select the surviving columns
+  @staticmethod
+  def compile(classifiers, featurizer, tolerance=1e-3):
+    weights    = []
+    intercepts = []
+    classes    = {}
+    spans      = {}
+    width      = 0
+
+    for cl in classifiers:
+      model = cl.model
+      if model is None or cl.vectorizer is not None:
+        raise ValueError(f'{cl.get_name()} was not trained on shared '
+                         'features')
+
+      # Binary models get a zero score column for their first class, so
+      # every model predicts the argmax of its columns
+      coef = model.coef_
+      bias = model.intercept_
+      if len(model.classes_) == 2:
+        coef = np.vstack([np.zeros_like(coef), coef])
+        bias = np.concatenate([np.zeros_like(bias), bias])
+
+      coef = np.where(np.abs(coef) >= tolerance * np.abs(coef).max(), coef,
+                      0.0)
+      weights.append(coef.T)
+      intercepts.append(bias)
+      classes[cl.get_name()] = np.asarray(model.classes_)
+      spans[cl.get_name()]   = (width, width + coef.shape[0])
+      width += coef.shape[0]
+
+    weights = np.hstack(weights)
+    kept    = np.flatnonzero(np.any(weights != 0, axis=1))
+    weights = np.ascontiguousarray(weights[kept], dtype=np.float32)
+
+    vectorizer = featurizer.vectorizer
+    columns    = kept
+    if getattr(vectorizer, 'vocabulary_', None) is not None:
+      terms = np.empty(len(vectorizer.vocabulary_), dtype=object)
+      for term, i in vectorizer.vocabulary_.items():
+        terms[i] = term
+
+      params     = dict(vectorizer.get_params(), vocabulary=list(terms[kept]))
+      vectorizer = CountVectorizer(**params)
+      columns    = None
+
+    return CompiledModels(vectorizer, columns, weights,
+                          np.concatenate(intercepts).astype(np.float32),
+                          classes, spans)
+
+  def __len__(self):
+    return len(self.weights)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    pass
+
+  # Restricted features of a DataFrame of sentences, what classify() takes
+  def transform(self, dataset):
+    features = self.vectorizer.transform(dataset.sentence.tolist())
+    if self.columns is not None:
+      features = features[:, self.columns]
+
+    return features
+
+  # Scores of every classifier, one column per class of each
+  def scores(self, features):
+    return features @ self.weights + self.intercepts
+
+  def predict(self, name, scores):
+    start, end = self.spans[name]
+    return self.classes[name][scores[:, start:end].argmax(axis=1)]
+
+  # Predictions for every (name, rows) job over the given rows of features,
+  # like ClassifierPool.classify. Features are scored once for all jobs
+  def classify(self, features, jobs):
+    start  = time.perf_counter()
+    scores = self.scores(features)
+    shared = (time.perf_counter() - start) / max(1, len(jobs))
+
+    results = []
+    for name, rows in jobs:
+      if name not in self.spans:
+        results.append(RuntimeError(f'{name} was not compiled'))
+        continue
+
+      start = time.perf_counter()
+      results.append(self.predict(name, scores[rows]))
+
+      if self.timings:
+        self.timings.record(f'classify/{name}',
+                            shared + time.perf_counter() - start, len(rows))
+
+    return results
+
+  # Predictions of every classifier for one sentence, without building a
+  # sparse matrix when the vocabulary is a dict lookup away
+  def classify_sentence(self, sentence):
+    if self.columns is not None:
+      scores = self.scores(
+        self.vectorizer.transform([sentence])[:, self.columns])[0]
+    else:
+      if self.analyzer is None:
+        self.analyzer = self.vectorizer.build_analyzer()
+        self.index    = {x: i for i, x in
+                         enumerate(self.vectorizer.vocabulary)}
+
+      found  = [self.index[x] for x in self.analyzer(sentence)
+                if x in self.index]
+      scores = self.weights[found].sum(axis=0) + self.intercepts
+
+    return {name: self.classes[name][scores[start:end].argmax()]
+            for name, (start, end) in self.spans.items()}
+
+  # Fraction of a dataset's sentences every compiled classifier predicts
+  # like the original one, kept in agreement
+  def check(self, classifiers, featurizer, dataset):
+    original = featurizer.transform(dataset)
+    scores   = self.scores(self.transform(dataset))
+
+    for cl in classifiers:
+      same = cl.classify(None, original) == self.predict(cl.get_name(), scores)
+      self.agreement[cl.get_name()] = float(same.mean()) if len(same) else 1.0
+
+    return self.agreement
+
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    state['timings']  = None
+    state['analyzer'] = None
+    state['index']    = None
+    return state
+
+  def save(self, path):
+    atomic_write(path, lambda f: pickle.dump(
+      self, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+  # Load models saved with save(), returns None if there are none usable
+  @staticmethod
+  def load(path, timings=None):
+    try:
+      with open(path, 'rb') as f:
+        compiled = pickle.load(f)
+    except FileNotFoundError:
+      return None
+    except (OSError, EOFError, AttributeError, ImportError, ValueError,
+            pickle.UnpicklingError) as e:
+      print(f'Could not load compiled models {path}. {repr(e)}')
+      return None
+
+    compiled.timings = timings
+    return compiled
@@ -0,0 +1,174 @@
+import os
+import sys
+import pickle
+
+from cache     import file_digest
+from terms     import TermStats
+from incidence import Incidence
+from store     import SentenceStore
+from article   import parse_path
+from files     import atomic_write
+
+# Bump whenever the layout of the saved state changes
+STATE_VERSION = 4
+
+# Sentence store file saved along with a corpus state file
+def store_path(path):
+  return f'{os.path.splitext(path)[0]}.store'
+
+# What is kept of one article between runs besides its rows in the store
+class ArticleRecord:
+  def __init__(self, path, article_id):
+    stat = os.stat(path)
+
+    self.path       = path
+    self.size       = stat.st_size
+    self.mtime      = stat.st_mtime
+    self.digest     = file_digest(path)
+    self.article_id = article_id
+
+  # Check if the file on disk still holds the contents this record was made
+  # from. Size and mtime are checked first to avoid hashing unchanged files
+  def matches(self, path):
+    try:
+      stat = os.stat(path)
+    except OSError:
+      return False
+
+    if stat.st_size == self.size and stat.st_mtime == self.mtime:
+      return True
+    if stat.st_size != self.size or file_digest(path) != self.digest:
+      return False
+
+    self.mtime = stat.st_mtime
+    return True
+
+# Persisted corpus: a SentenceStore with the sentences and predictions of
+# every article, the frozen training sample and, per classifier, the ids of
+# the articles it classified and their term counts along with the merged
+# TermStats. Lets a rerun only process what changed. Article ids come from
+# the store and are never reused. The store is saved to its own memory
+# mapped file next to the state, see store_path
+class CorpusState:
+  def __init__(self):
+    self.version     = STATE_VERSION
+    self.store       = SentenceStore()
+    self.generation  = None
+    self.records     = {}
+    self.training    = None
+    self.model_keys  = {}
+    self.classified  = {}
+    self.term_counts = {}
+    self.aggregates  = {}
+
+  @staticmethod
+  def load(path):
+    if not os.path.isfile(path):
+      return CorpusState()
+
+    try:
+      with open(path, 'rb') as f:
+        state = pickle.load(f)
+    except (OSError, EOFError, AttributeError, pickle.UnpicklingError) as e:
+      print(f'Could not load corpus state. {repr(e)}', file=sys.stderr)
+      return CorpusState()
+
+    if getattr(state, 'version', None) != STATE_VERSION:
+      return CorpusState()
+
+    # The store has to be the one saved along with this state
+    store = SentenceStore.open(store_path(path))
+    if store is None or store.generation != state.generation:
+      print('Sentence store does not match corpus state', file=sys.stderr)
+      return CorpusState()
+
+    state.store = store
+    return state
+
+  # The store is written first, the state only refers to it by generation
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    del state['store']
+    return state
+
+  def save(self, path):
+    self.store.compact()
+    self.generation = self.store.save(store_path(path))
+
+    atomic_write(path, lambda f: pickle.dump(
+      self, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+  # Split pdf paths into new or modified ones, and saved ones now missing
+  def changes(self, pdf_paths):
+    stale   = [x for x in pdf_paths
+               if x not in self.records or not self.records[x].matches(x)]
+    present = set(pdf_paths)
+    removed = [x for x in self.records if x not in present]
+
+    return stale, removed
+
+  # Add an extracted article to the store, keep holds the sentence filter
+  # flags. Returns its id
+  def add_article(self, path, sentences, keep):
+    article_id         = self.store.add(path, *parse_path(path), sentences, keep)
+    self.records[path] = ArticleRecord(path, article_id)
+
+    return article_id
+
+  def drop_article(self, path):
+    if path not in self.records:
+      return
+
+    article_id = self.records[path].article_id
+    for name in self.classified:
+      self.classified[name].discard(article_id)
+      self.aggregates[name].remove(article_id,
+        self.term_counts[name].pop(article_id, {}))
+
+    self.store.remove(article_id)
+    del self.records[path]
+
+  def get_id(self, path):
+    return self.records[path].article_id
+
+  def get_path(self, article_id):
+    return self.store.get_path(article_id)
+
+  # Ids of all articles, ordered by path
+  def article_ids(self):
+    return [self.records[x].article_id for x in sorted(self.records)]
+
+  # Predictions are only valid for the model that produced them, anything
+  # computed with a different one is thrown away
+  def set_model_key(self, name, key):
+    if name in self.model_keys and self.model_keys[name] == key:
+      return
+
+    self.model_keys[name]  = key
+    self.classified[name]  = set()
+    self.term_counts[name] = {}
+    self.aggregates[name]  = TermStats()
+    self.store.clear_predictions(name)
+
+  # Ids of the articles not classified yet by a classifier, ordered by path
+  def pending(self, name):
+    done = self.classified.get(name, set())
+    return [x for x in self.article_ids() if x not in done]
+
+  # Record the term counts of an article once its predictions are written
+  # to the store
+  def add_terms(self, name, article_id, counts):
+    self.classified[name].add(article_id)
+    self.term_counts[name][article_id] = counts
+    self.aggregates[name].add(article_id, counts)
+
+  # TermStats of one classifier, postings hold article ids
+  def get_stats(self, name):
+    return self.aggregates.get(name, TermStats())
+
+  # Term by article Incidence of one classifier, over every term or only
+  # the given ones, with a column per article id
+  def incidence(self, name, terms=None):
+    self.store.flush()
+    return Incidence.from_stats(self.get_stats(name), len(self.store.paths),
+                                terms)
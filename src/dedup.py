@@ -0,0 +1,67 @@
+import hashlib
+import numpy as np
+
+# Marks a sentence a classifier has not been run on yet
+UNKNOWN = -128
+
+# Sentences equal after lowercasing and collapsing whitespace get the same
+# features and the same tokens, so they are classified and tagged once
+def normalize(sentence):
+  return ' '.join(sentence.lower().split())
+
+def sentence_key(sentence):
+  return hashlib.blake2b(normalize(sentence).encode('utf-8'),
+                         digest_size=8).digest()
+
+# Index of the distinct normalized sentences seen so far, each with a row
+# holding its prediction from every classifier. The (article, position) of
+# every occurrence maps to its row through sentence_key, so predictions of
+# repeated headers, captions or copied paragraphs are computed once and
+# still counted once per occurrence
+class SentenceIndex:
+  def __init__(self):
+    self.rows        = {}
+    self.size        = 0
+    self.capacity    = 0
+    self.predictions = {}
+
+  def __len__(self):
+    return self.size
+
+  # Rows for a list of sentences, adding the ones not seen before
+  def lookup(self, sentences):
+    rows = np.empty(len(sentences), dtype=np.int64)
+    for i, sentence in enumerate(sentences):
+      key = sentence_key(sentence)
+      row = self.rows.get(key)
+      if row is None:
+        row = self.rows[key] = self.size
+        self.size += 1
+      rows[i] = row
+
+    self.reserve(self.size)
+    return rows
+
+  def reserve(self, size):
+    if size <= self.capacity:
+      return
+
+    self.capacity = max(size, 2 * self.capacity, 1024)
+    for name, predictions in self.predictions.items():
+      grown = np.full(self.capacity, UNKNOWN, dtype=np.int8)
+      grown[:len(predictions)] = predictions
+      self.predictions[name] = grown
+
+  def get_predictions(self, name):
+    if name not in self.predictions:
+      self.predictions[name] = np.full(self.capacity, UNKNOWN, dtype=np.int8)
+
+    return self.predictions[name]
+
+  # Rows among the given ones a classifier has no prediction for yet
+  def missing(self, name, rows):
+    rows = np.unique(rows)
+    return rows[self.get_predictions(name)[rows] == UNKNOWN]
+
+  def set_predictions(self, name, rows, predictions):
+    self.get_predictions(name)[rows] = predictions
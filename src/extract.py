@@ -0,0 +1,149 @@
+import io
+import sys
+import time
+import signal
+import threading
+from contextlib import contextmanager
+
+from nltk import tokenize
+
+# Raised when a document takes longer than the extraction timeout
+class ExtractionTimeout(Exception):
+  pass
+
+# Text of each page of a pdf, parsed in process with pdfminer. Pages are
+# yielded as soon as they are laid out, at most max_pages of them
+def pdfminer_pages(path, max_pages=None):
+  from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+  from pdfminer.converter import TextConverter
+  from pdfminer.layout    import LAParams
+  from pdfminer.pdfpage   import PDFPage
+
+  manager = PDFResourceManager()
+  output  = io.BytesIO()
+  device  = TextConverter(manager, output, codec='utf-8', laparams=LAParams())
+  try:
+    interpreter = PDFPageInterpreter(manager, device)
+    with open(path, 'rb') as f:
+      for page in PDFPage.get_pages(f, maxpages=max_pages or 0):
+        interpreter.process_page(page)
+
+        yield output.getvalue().decode('utf-8', 'ignore')
+        output.seek(0)
+        output.truncate()
+  finally:
+    device.close()
+
+# Whole text of a document through textract, which shells out to an external
+# converter. Comes as a single page, so max_pages does not apply
+def textract_pages(path, max_pages=None):
+  import textract
+
+  yield textract.process(path).decode('utf-8')
+
+# Pages of an already extracted plain text file, separated by form feeds as
+# in pdftotext output
+def text_pages(path, max_pages=None):
+  with open(path, 'r', encoding='utf-8') as f:
+    pages = f.read().split('\f')
+
+  yield from pages[:max_pages] if max_pages else pages
+
+# Available extraction backends, by name
+backends = {
+  'pdfminer': pdfminer_pages,
+  'textract': textract_pages,
+  'text':     text_pages,
+}
+
+# Raise ExtractionTimeout in the main thread once seconds have passed. Does
+# nothing elsewhere, where signals can not be delivered
+@contextmanager
+def time_limit(seconds):
+  if (not seconds or not hasattr(signal, 'SIGALRM') or
+      threading.current_thread() is not threading.main_thread()):
+    yield
+    return
+
+  def expire(signum, frame):
+    raise ExtractionTimeout
+
+  previous = signal.signal(signal.SIGALRM, expire)
+  signal.setitimer(signal.ITIMER_REAL, seconds)
+  try:
+    yield
+  finally:
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    signal.signal(signal.SIGALRM, previous)
+
+# Split a stream of page texts into sentences while it is read. The last
+# sentence of what has been read so far may continue on the next page, so it
+# is carried over and tokenized again along with it
+def stream_sentences(pages):
+  carry = ''
+  for page in pages:
+    text      = page.replace('\n', ' ')
+    text      = f'{carry} {text}' if carry else text
+    sentences = tokenize.sent_tokenize(text)
+    carry     = sentences.pop() if sentences else ''
+
+    for sentence in sentences:
+      yield sentence.strip()
+
+  if carry:
+    yield carry.strip()
+
+# Turns pdfs into sentences with the first backend that can read them, in
+# order. Documents are cut after max_pages pages and after timeout seconds,
+# keeping the sentences read until then
+class Extractor:
+  def __init__(self, backends=('pdfminer', 'textract'), max_pages=None,
+               timeout=None):
+    self.backends  = tuple(backends)
+    self.max_pages = max_pages
+    self.timeout   = timeout
+
+  # Anything changing the sentences of a document, for cache keys
+  def fingerprint(self):
+    return f'{",".join(self.backends)}:{self.max_pages}'
+
+  # Returns (raw_text, sentences, complete), complete is False if the
+  # document was cut short by the timeout
+  def extract(self, path):
+    for i, name in enumerate(self.backends):
+      last = i == len(self.backends) - 1
+      try:
+        return self.extract_with(backends[name], path)
+      except FileNotFoundError:
+        raise
+      except Exception as e:
+        if last:
+          raise
+        print(f'{name} could not read {path}, trying the next backend. '
+              f'{repr(e)}', file=sys.stderr)
+
+  def extract_with(self, backend, path):
+    pages     = []
+    sentences = []
+    deadline  = time.monotonic() + self.timeout if self.timeout else None
+
+    def read_pages():
+      for page in backend(path, self.max_pages):
+        pages.append(page)
+        yield page
+
+        # Also checked between pages for when no alarm can be set
+        if deadline and time.monotonic() > deadline:
+          raise ExtractionTimeout
+
+    complete = True
+    try:
+      with time_limit(self.timeout):
+        for sentence in stream_sentences(read_pages()):
+          sentences.append(sentence)
+    except ExtractionTimeout:
+      print(f'Extraction of {path} timed out after {len(pages)} pages',
+            file=sys.stderr)
+      complete = False
+
+    return ''.join(pages), sentences, complete
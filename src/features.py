@@ -0,0 +1,87 @@
+import pickle
+import hashlib
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+
+from files import atomic_write
+
+# Bump whenever the featurization changes
+FEATURES_VERSION = 1
+
+# Document-term featurization shared by all classifiers. The vocabulary is
+# fit once on the whole training set, so the corpus is vectorized a single
+# time and every classifier's model reads rows of the same sparse matrix
+class Featurizer:
+  def __init__(self, ngram_range=(1, 5)):
+    self.ngram_range = ngram_range
+    self.vectorizer  = None
+
+  def fingerprint(self, dataset):
+    digest = hashlib.sha256(
+      f'{FEATURES_VERSION}:{self.ngram_range}'.encode('utf-8'))
+
+    for sentence in dataset.sentence:
+      digest.update(sentence.encode('utf-8'))
+      digest.update(b'\0')
+
+    return digest.hexdigest()
+
+  def is_fit(self):
+    return self.vectorizer is not None
+
+  def fit(self, dataset):
+    self.vectorizer = CountVectorizer(ngram_range=self.ngram_range)
+    return self.vectorizer.fit_transform(dataset.sentence.tolist())
+
+  def transform(self, dataset):
+    if not self.vectorizer:
+      raise RuntimeError('Featurizer has not been fit')
+
+    return self.vectorizer.transform(dataset.sentence.tolist())
+
+  def save(self, path):
+    atomic_write(path, lambda f: pickle.dump(
+      self.vectorizer, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+  # Load a vectorizer saved with save(), returns False if there is none usable
+  def load(self, path):
+    try:
+      with open(path, 'rb') as f:
+        self.vectorizer = pickle.load(f)
+    except FileNotFoundError:
+      return False
+    except (OSError, EOFError, AttributeError, ImportError, ValueError,
+            pickle.UnpicklingError) as e:
+      print(f'Could not load features {path}. {repr(e)}')
+      return False
+
+    return True
+
+# Stateless featurization for out-of-core training, n-grams are hashed into
+# n_features columns so there is no vocabulary to fit or keep in memory.
+# Same interface as Featurizer, fitting only transforms
+class HashingFeaturizer:
+  def __init__(self, n_features=1 << 20, ngram_range=(1, 5)):
+    self.ngram_range = ngram_range
+    self.n_features  = n_features
+    self.vectorizer  = HashingVectorizer(n_features=n_features,
+      ngram_range=ngram_range, alternate_sign=False)
+
+  def fingerprint(self, dataset=None):
+    return hashlib.sha256(
+      f'{FEATURES_VERSION}:hashing:{self.n_features}:{self.ngram_range}'
+      .encode('utf-8')).hexdigest()
+
+  def is_fit(self):
+    return True
+
+  def fit(self, dataset):
+    return self.transform(dataset)
+
+  def transform(self, dataset):
+    return self.vectorizer.transform(dataset.sentence.tolist())
+
+  def save(self, path):
+    pass
+
+  def load(self, path):
+    return True
@@ -0,0 +1,28 @@
+import os
+import tempfile
+
+src_dir  = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(src_dir)
+
+# Path of a file in the repository, for defaults that do not depend on where
+# a script is run from
+def repo_path(*parts):
+  return os.path.join(root_dir, *parts)
+
+# Write a file through writer(f), given the file opened for binary writing.
+# The contents go to a temp file next to path that then replaces it, so
+# readers and concurrent writers never see half a file. The temp file is
+# removed if writing fails, and the error raised again
+def atomic_write(path, writer):
+  file_dir = os.path.dirname(path) or '.'
+  os.makedirs(file_dir, exist_ok=True)
+
+  fd, tmp_path = tempfile.mkstemp(dir=file_dir, suffix='.tmp')
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      writer(f)
+    os.replace(tmp_path, path)
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
@@ -1,8 +1,11 @@
+import csv
+import json
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.ticker import MaxNLocator
 
+# Matplotlib is only imported to plot, counts can be built and exported
+# without it
 def get_cmap(n, name='hsv'):
+  import matplotlib.pyplot as plt
   cm  = plt.cm.get_cmap(name, n)
   ret = []
 
@@ -11,38 +14,115 @@ def get_cmap(n, name='hsv'):
 
   return ret
 
+# Articles per year of each term. Every term is counted with one bincount
+# over the years of its articles, bins run from first_year to last_year,
+# the corpus range when given, otherwise the range of the counted years
 class Histogram:
-  def __init__(self, concept):
-    self.concept = concept
-    self.labels  = []
-    self.counts  = []
+  def __init__(self, concept, first_year=None, last_year=None):
+    self.concept    = concept
+    self.first_year = first_year
+    self.last_year  = last_year
+    self.labels     = []
+    self.counts     = []
+    self.offsets    = []
 
   def count_concept(self, subconcept, articles):
-    years = []
+    self.count_years(subconcept, [x.get_year() for x in articles])
 
-    # Extract years from all articles associated to this subconcept
-    for article in articles:
-      years.append(article.get_year())
+  # Count a term from the years of its articles, an array or any sequence
+  def count_years(self, subconcept, years):
+    years  = np.asarray(years, dtype=np.int64)
+    offset = int(years.min()) if len(years) else 0
 
+    self.count_bins(subconcept, offset, np.bincount(years - offset))
+
+  # Add a term already counted, counts[i] articles in year offset + i
+  def count_bins(self, subconcept, offset, counts):
     self.labels.append(subconcept)
-    self.counts.append(years)
+    self.counts.append(np.asarray(counts, dtype=np.int64))
+    self.offsets.append(offset)
+
+  # Years of the bins, from the corpus range or the counted years
+  def years(self):
+    first = self.first_year
+    last  = self.last_year
+    spans = [(x, x + len(c) - 1) for x, c in zip(self.offsets, self.counts)
+             if len(c)]
+
+    if first is None:
+      first = min((x for x, _ in spans), default=0)
+    if last is None:
+      last = max((x for _, x in spans), default=first)
+
+    return np.arange(first, max(first, last) + 1)
+
+  # Terms by years matrix of article counts. Years outside the bins are
+  # left out, there are none without a fixed range
+  def table(self):
+    years = self.years()
+    table = np.zeros((len(self.labels), len(years)), dtype=np.int64)
+
+    for i, (offset, counts) in enumerate(zip(self.offsets, self.counts)):
+      start = offset - years[0]
+      lo    = max(0, -start)
+      hi    = min(len(counts), len(years) - start)
+      if lo < hi:
+        table[i, start + lo:start + hi] = counts[lo:hi]
 
-  def plot(self, pathname):
-    bins = np.arange(2010, 2021)
+    return years, table
+
+  # Write the counts to pathname.fmt without plotting, as a csv with a row
+  # per year and a column per term, or as json
+  def export(self, pathname, fmt='csv'):
+    years, table = self.table()
+    path         = f'{pathname}.{fmt}'
+
+    if fmt == 'json':
+      with open(path, 'w') as f:
+        json.dump({'concept': self.concept,
+                   'years':   years.tolist(),
+                   'counts':  dict(zip(self.labels, table.tolist()))},
+                  f, indent=2)
+    else:
+      with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['year'] + self.labels)
+        for year, row in zip(years.tolist(), table.T.tolist()):
+          writer.writerow([year] + row)
+
+    return path
+
+  # Save the histogram to pathname.fmt. Font sizes scale with the figure
+  # width, the figure is closed once saved
+  def plot(self, pathname, size=(32, 18), dpi=300, fmt='png'):
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import MaxNLocator
+
+    years, table = self.table()
+    bins         = np.append(years, years[-1] + 1)
+    step         = max(1, len(years) // 20)
+    scale        = size[0] / 32.0
 
     # Plot formatting
-    plt.figure(figsize=(32, 18), dpi=300)
-    plt.title(f'Terms for topic: {self.concept}', fontsize=70)
-    plt.xlabel('Year of publication', fontsize=50)
-    plt.ylabel('Articles with reference to term', fontsize=50)
-    plt.xticks(ticks=bins, labels=bins, fontsize=20)
-    plt.yticks(fontsize=30)
-    plt.gca().yaxis.set_major_locator(MaxNLocator(integer=True))
+    fig = plt.figure(figsize=size, dpi=dpi)
+    try:
+      plt.title(f'Terms for topic: {self.concept}', fontsize=70 * scale)
+      plt.xlabel('Year of publication', fontsize=50 * scale)
+      plt.ylabel('Articles with reference to term', fontsize=50 * scale)
+      plt.xticks(ticks=years[::step] + 0.5, labels=years[::step],
+                 fontsize=20 * scale)
+      plt.yticks(fontsize=30 * scale)
+      plt.gca().yaxis.set_major_locator(MaxNLocator(integer=True))
+
+      # Plotting, counts are weights of one point per year and term
+      if len(self.labels):
+        plot = plt.hist([years] * len(self.labels), bins, weights=list(table),
+          histtype='bar', stacked=False, fill=True, label=self.labels)
 
-    # Plotting
-    plot = plt.hist(self.counts, bins, histtype='bar', stacked=False, fill=True,
-      label=self.labels)
+        plt.legend(loc='upper left', labels=self.labels, fontsize=30 * scale)
 
-    plt.legend(loc='upper left', labels=self.labels, fontsize=30)
+      plt.savefig(f'{pathname}.{fmt}', format=fmt)
+    finally:
+      plt.close(fig)
 
-    plt.savefig(pathname)
+    return f'{pathname}.{fmt}'
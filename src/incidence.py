@@ -0,0 +1,114 @@
+import numpy as np
+import scipy.sparse as sp
+
+# Term by article incidence of one classifier, a csr matrix with a row per
+# term and a column per article id, 1 where the article uses the term.
+# Co-occurrence, article similarity and year counts are sparse products of
+# it, so none of them loops over pairs in Python
+class Incidence:
+  def __init__(self, terms, matrix):
+    self.terms  = list(terms)
+    self.index  = {x: i for i, x in enumerate(self.terms)}
+    self.matrix = matrix.tocsr()
+
+  # From the postings of a TermStats, every term or only the given ones in
+  # their order. n_articles is the number of article ids, dropped ones
+  # included, so columns are article ids
+  @staticmethod
+  def from_stats(stats, n_articles, terms=None):
+    if terms is None:
+      terms = list(stats.postings)
+
+    postings = [stats.get_postings(x) for x in terms]
+    indptr   = np.zeros(len(terms) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(x) for x in postings])
+    indices  = (np.concatenate([np.frombuffer(x, dtype=f'i{x.itemsize}')
+                                for x in postings if len(x)])
+                if indptr[-1] else np.zeros(0, dtype=np.int64))
+
+    matrix = sp.csr_matrix(
+      (np.ones(len(indices), dtype=np.int32), indices, indptr),
+      shape=(len(terms), n_articles))
+    matrix.sum_duplicates()
+
+    return Incidence(terms, matrix)
+
+  def __len__(self):
+    return len(self.terms)
+
+  def rows(self, terms):
+    return [self.index[x] for x in terms]
+
+  # Ids of the articles using a term, in id order
+  def articles(self, term):
+    return self.matrix[self.index[term]].indices.copy()
+
+  # Ids of the articles using every one of the terms
+  def shared_articles(self, terms):
+    counts = np.asarray(self.matrix[self.rows(terms)].sum(axis=0)).ravel()
+    return np.flatnonzero(counts == len(terms))
+
+  # Articles using each pair of terms, a sparse terms by terms matrix whose
+  # diagonal holds document frequencies. Over the given terms only when
+  # terms is given
+  def cooccurrence(self, terms=None):
+    matrix = self.matrix if terms is None else self.matrix[self.rows(terms)]
+    return (matrix @ matrix.T).tocsr()
+
+  # The k terms sharing most articles with a term, with their counts
+  def related_terms(self, term, k=10):
+    row    = self.matrix[self.index[term]]
+    counts = np.asarray((self.matrix @ row.T).todense()).ravel()
+    counts[self.index[term]] = 0
+
+    top = np.argsort(-counts, kind='stable')[:k]
+    return [(self.terms[i], int(counts[i])) for i in top if counts[i] > 0]
+
+  # Terms shared by each pair of the given articles, all by default, as a
+  # sparse matrix. With cosine they are divided by the geometric mean of
+  # both articles' numbers of terms
+  def similarity(self, article_ids=None, cosine=False):
+    matrix = (self.matrix if article_ids is None else
+              self.matrix[:, article_ids])
+    shared = (matrix.T @ matrix).tocsr()
+    if not cosine:
+      return shared
+
+    norms = np.sqrt(shared.diagonal().astype(np.float64))
+    norms[norms == 0] = 1.0
+    scale = sp.diags(1.0 / norms)
+    return (scale @ shared @ scale).tocsr()
+
+  # The k articles sharing most terms with an article, with their counts
+  def similar_articles(self, article_id, k=10):
+    column = self.matrix[:, article_id]
+    counts = np.asarray((self.matrix.T @ column).todense()).ravel()
+    counts[article_id] = 0
+
+    top = np.argsort(-counts, kind='stable')[:k]
+    return [(int(i), int(counts[i])) for i in top if counts[i] > 0]
+
+  # Articles per year of every term from the year of each article id,
+  # returns the years from first to last and a dense terms by years matrix.
+  # Articles outside the range are not counted
+  def year_counts(self, years, first, last):
+    years = np.asarray(years, dtype=np.int64)
+    ids   = np.flatnonzero((years >= first) & (years <= last))
+    bins  = sp.csr_matrix(
+      (np.ones(len(ids), dtype=np.int32), (ids, years[ids] - first)),
+      shape=(self.matrix.shape[1], last - first + 1))
+
+    return np.arange(first, last + 1), (self.matrix @ bins).toarray()
+
+  # Save to a npz file readable by numpy alone, terms included
+  def save(self, path):
+    np.savez_compressed(path, data=self.matrix.data,
+      indices=self.matrix.indices, indptr=self.matrix.indptr,
+      shape=np.array(self.matrix.shape), terms=np.array(self.terms, dtype=str))
+
+  @staticmethod
+  def load(path):
+    with np.load(path) as f:
+      matrix = sp.csr_matrix((f['data'], f['indices'], f['indptr']),
+                             shape=tuple(f['shape']))
+      return Incidence(f['terms'].tolist(), matrix)
@@ -0,0 +1,53 @@
+import sys
+import os
+from collections        import deque
+from functools          import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import labelers
+from article import extract_text
+
+# Extract the sentences of a single pdf along with the flags of the ones that
+# pass the sentence filter, computed here so workers do the filtering too.
+# Invalid files are reported and skipped. LookupError is left to the caller
+def extract_article(pdf_path, cache=None, extractor=None):
+  try:
+    sentences = extract_text(pdf_path, cache, extractor)
+  except (FileNotFoundError, UnicodeDecodeError):
+    print(f'Article path {pdf_path} is not a valid file!', file=sys.stderr)
+    return None
+
+  keep = [labelers.simple_filter(x) for x in sentences]
+  return pdf_path, sentences, keep
+
+# Yield (path, sentences, keep) for all given pdfs as they are extracted, in
+# pdf_paths order, spreading extraction over a process pool when workers > 1.
+# At most a few articles per worker are in flight. If a TextCache is given,
+# unchanged files are loaded from it instead of being re-extracted
+def iter_articles(pdf_paths, workers=1, cache=None, extractor=None):
+  if workers is None:
+    workers = os.cpu_count() or 1
+
+  extract = partial(extract_article, cache=cache, extractor=extractor)
+  if workers <= 1 or len(pdf_paths) <= 1:
+    results = map(extract, pdf_paths)
+    yield from (x for x in results if x is not None)
+  else:
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      results = bounded_map(pool, extract, pdf_paths, workers * 4)
+      yield from (x for x in results if x is not None)
+
+  # Evict only once all workers are done writing
+  if cache:
+    cache.evict()
+
+# Ordered pool.map that never has more than window tasks submitted
+def bounded_map(pool, f, items, window):
+  futures = deque()
+  for item in items:
+    futures.append(pool.submit(f, item))
+    if len(futures) >= window:
+      yield futures.popleft().result()
+
+  while futures:
+    yield futures.popleft().result()
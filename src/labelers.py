@@ -1,5 +1,7 @@
 import re
+import numpy as np
 from enum             import IntEnum
+from functools        import partial
 from snorkel.labeling import labeling_function
 from snorkel.labeling import LabelingFunction
 
@@ -8,6 +10,9 @@ from snorkel.labeling import LabelingFunction
 #                                                             #
 # Write at least 3 labeler functions associated to said label #
 # Register functions in new labeler function list             #
+#                                                             #
+# Optionally give a labeler function a vectorized version     #
+# with batch_labeler, it must return the exact same labels    #
 ###############################################################
 
 # Labels returned by labeler functions
@@ -27,21 +32,103 @@ def count_char_kinds(w):
 
   return (uppers, lowers, digits)
 
-def contains_keyword(s, keywords, label, lower=True):
-  if lower:
-    s = s.sentence.lower()
-  else:
-    s = s.sentence
+# Finds every registered keyword contained in a sentence with one compiled
+# alternation, tried longest keyword first. Searching again one character
+# after each match start reports the longest keyword starting at every
+# position, and the shorter keywords it contains come from the implied table
+class KeywordMatcher:
+  def __init__(self, keywords=(), cache_size=1 << 16):
+    self.keywords   = set()
+    self.pattern    = None
+    self.implied    = {}
+    self.cache      = {}
+    self.cache_size = cache_size
+
+    self.add(keywords)
+
+  def add(self, keywords):
+    new = set(x for x in keywords if x) - self.keywords
+    if not new:
+      return
+
+    self.keywords |= new
+    self.pattern   = None
+    self.cache     = {}
+
+  def compile(self):
+    ordered = sorted(self.keywords, key=len, reverse=True)
+
+    self.pattern = re.compile('|'.join(re.escape(x) for x in ordered))
+    self.implied = {k: frozenset(x for x in self.keywords if x in k)
+                    for k in self.keywords}
+
+  # Set of registered keywords in a sentence, lowercasing it first if asked.
+  # Results are memoized since every keyword labeler and simple_filter ask
+  # about the same sentences
+  def find(self, sentence, lower=True):
+    key = (sentence, lower)
+    if key in self.cache:
+      return self.cache[key]
+
+    if self.pattern is None:
+      self.compile()
+
+    text    = sentence.lower() if lower else sentence
+    matched = frozenset()
+    match   = self.pattern.search(text)
+    while match:
+      matched = matched | self.implied[match.group()]
+      match   = self.pattern.search(text, match.start() + 1)
+
+    if len(self.cache) >= self.cache_size:
+      self.cache = {}
+    self.cache[key] = matched
+
+    return matched
+
+# Shared by all keyword labelers and simple_filter
+keyword_matcher = KeywordMatcher()
 
-  if any(keyword in s for keyword in keywords):
+def contains_keyword(s, keywords, label, lower=True):
+  if keyword_matcher.find(s.sentence, lower).intersection(keywords):
     return label
 
   return Label.PASS
 
+def contains_keyword_batch(batch, keywords, label, lower=True):
+  matched = np.zeros(len(batch), dtype=bool)
+  for keyword in keywords:
+    matched |= batch.contains(keyword, lower, keyword_matcher)
+
+  return np.where(matched, label, Label.PASS)
+
 def new_contains(keywords, label=Label.CLASS):
-  return LabelingFunction(name=f'contains_{keywords[0]}',
-                          f=contains_keyword,
-                          resources=dict(keywords=keywords, label=label))
+  keyword_matcher.add(keywords)
+
+  lf = LabelingFunction(name=f'contains_{keywords[0]}',
+                        f=contains_keyword,
+                        resources=dict(keywords=keywords, label=label))
+  lf.batch_f = partial(contains_keyword_batch, keywords=keywords, label=label)
+
+  return lf
+
+# Attach a vectorized version to a labeler function. batch_f takes an
+# applier.SentenceBatch and returns one label per sentence
+def batch_labeler(batch_f):
+  def decorator(lf):
+    lf.batch_f = batch_f
+    return lf
+
+  return decorator
+
+# Filter out sentences with doi links, emails, or other unrelated stuff
+filter_keywords = frozenset(['et', 'license', 'doi', '@'])
+keyword_matcher.add(filter_keywords)
+
+# Filter out sentences with references of the form: 'Genes 1(2):227–243.',
+# and stuf like 'pp 465-657'. Only the first line can match, since '.' does
+# not match newlines
+ref_regex = re.compile('[0-9]+\(.*\)\:.[0-9]+|pp[0-9]+.[0-9]+')
 
 # Function used to exclude certain sentences from labeling analysis
 # NOT A LABELER
@@ -50,25 +137,17 @@ def simple_filter(sentence):
   digits     = sum(c.isdigit() for c in sentence)
   s_no_space = sentence.replace(' ', '')
 
-  # Filter out sentences with doi links, emails, or other unrelated stuff
-  keywords  = ['et', 'license', 'doi', '@']
-  # Filter out sentences with references of the form: 'Genes 1(2):227–243.',
-  # and stuf like 'pp 465-657'
-  ref_regex  = '.*[0-9]+\(.*\)\:.[0-9]+.*'
-  pp_regex   = '.*pp[0-9]+.[0-9]+.*'
-
   # Filter out sentences with less than 2 words
   if len(toks) < 2:
     return False
   # Filter out sentences that contain banned keywords
-  if any(keyword in sentence.lower() for keyword in keywords):
+  if keyword_matcher.find(sentence) & filter_keywords:
     return False
   # Filter out sentences with mostly numbers
   if digits > len(sentence) / 2:
     return False
   # Filter out reference regex
-  if (re.match(ref_regex,  s_no_space) or
-      re.match(pp_regex,   s_no_space)):
+  if ref_regex.search(s_no_space.partition('\n')[0]):
     return False
   # Filter out et al if sentence is short
   if 'et al.' in sentence and len(toks) < 10:
@@ -103,6 +182,11 @@ def cap_words(s):
 
   return Label.PASS
 
+def version_number_batch(batch):
+  matched = batch.sentences.str.match('[0-9]+(\.[0-9]+)+').to_numpy()
+  return np.where(matched, Label.CLASS, Label.ABSTAIN)
+
+@batch_labeler(version_number_batch)
 @labeling_function()
 def version_number(s):
   # Matches stuff like '2.5.1417'
@@ -118,6 +202,12 @@ def version_number(s):
 contains_strain  = new_contains(['strain'])
 contains_species = new_contains(['species'])
 
+def latin_suffix_batch(batch):
+  # A word ending in 'ium' is followed by whitespace or the end of sentence
+  matched = batch.get_lowered().str.contains('ium(?:\\s|$)').to_numpy()
+  return np.where(matched, Label.CLASS, Label.ABSTAIN)
+
+@batch_labeler(latin_suffix_batch)
 @labeling_function()
 def latin_suffix(s):
   words = s.sentence.split()
@@ -210,3 +300,13 @@ registered_method   = [contains_enrich, contains_fold, contains_method,
 registered_molecule = [contains_adna, contains_dna, contains_rna]
 registered_property = [contains_clonal, contains_gc, contains_hybrid,
                        contains_bias, contains_dup, contains_length]
+
+# Label sets by name, in the order classifiers are built and reported
+registered = {
+  'software': registered_software,
+  'species':  registered_species,
+  'sample':   registered_sample,
+  'method':   registered_method,
+  'molecule': registered_molecule,
+  'property': registered_property,
+}
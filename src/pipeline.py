@@ -0,0 +1,235 @@
+import sys
+import string
+import numpy as np
+import pandas as pd
+
+from article    import Article
+from tagger     import Tagger
+from classifier import ClassifierPool
+from dedup      import SentenceIndex
+from timing     import Timings
+from relgraph   import RelGraph
+from histogram  import Histogram
+
+# POS tags never counted as terms
+filtered_tags = ('DT', 'IN', 'CC', 'EX', 'TO', 'WDT', 'PRP',
+                 'VBG', 'CD', 'WRB', 'MD', 'VBZ', 'RP', 'SYM',
+                 'UH', 'PRP', 'PRP$', 'RB', 'RBS', 'WP', 'VB')
+
+# Count single words and two word compounds in CLASS predicted sentences,
+# taking tokens and tags from a shared Tagger
+def count_terms(sentences, predictions, tagger=None):
+  if tagger is None:
+    tagger = Tagger()
+  curr_dict = {}
+
+  for sentence, prediction in zip(sentences, predictions):
+    if prediction != 0:
+      continue
+
+    toks, tags = tagger.get(sentence)
+
+    # Walk over sentence with two word sliding window
+    for i in range(len(toks) - 1):
+      w0           = toks[i]
+      w1           = toks[i + 1]
+      compound     = f'{w0} {w1}'
+
+      # Skip over useless tags
+      if (tags[i] in filtered_tags or
+          (len(w0) == 1 and w0 in string.punctuation)):
+        continue
+
+      # Add single word
+      count         = curr_dict.get(w0, 0) + 1
+      curr_dict[w0] = count
+
+      # Skip over useless tags
+      if (tags[i + 1] in filtered_tags or
+          (len(w1) == 1 and w1 in string.punctuation)):
+        continue
+
+      # Add two words
+      count               = curr_dict.get(compound, 0) + 1
+      curr_dict[compound] = count
+
+  return curr_dict
+
+# Group articles into batches of at least batch_size filtered sentences, the
+# last one aside. Articles are never split between batches. Batches are
+# lists of (article id, store rows of its filtered sentences)
+def article_batches(store, article_ids, batch_size):
+  batch = []
+  size  = 0
+  for article_id in article_ids:
+    rows = store.kept_rows(article_id)
+    batch.append((article_id, rows))
+    size += len(rows)
+
+    if size >= batch_size:
+      yield batch
+      batch = []
+      size  = 0
+
+  if batch:
+    yield batch
+
+# Filtered sentences of the given articles as DataFrames of at least
+# batch_size sentences for out-of-core training. Articles come in a seeded
+# random order, the same on every call, so batches mix the whole corpus
+def training_batches(store, article_ids, batch_size, seed=1):
+  ids = np.random.RandomState(seed).permutation(np.asarray(article_ids))
+
+  for batch in article_batches(store, ids, batch_size):
+    rows = np.concatenate([x for _, x in batch]).astype(np.int64)
+    if len(rows):
+      yield pd.DataFrame({'sentence': store.sentences(rows)})
+
+# Draw the same sample as pandas' Series.sample(size, random_state=seed)
+# over the filtered sentences of the given articles, in order. Only the
+# picked sentences are decoded. Returns None if there are not enough
+def draw_training(store, article_ids, size, seed=1):
+  rows = np.concatenate([np.zeros(0, dtype=np.int64)] +
+                        [store.kept_rows(x) for x in article_ids])
+  if len(rows) < size:
+    return None
+
+  # Series.sample picks the first positions of a random permutation
+  picks = np.random.RandomState(seed).permutation(len(rows))[:size]
+  return store.sentences(rows[picks])
+
+# Classify every article a classifier has not seen yet, a batch of articles
+# at a time. Repeated sentences are looked up in a SentenceIndex, so only
+# distinct sentences no classifier has predicted yet are featurized, once
+# per batch, and handed to all classifiers through the ClassifierPool. The
+# CLASS sentences of all classifiers are tagged together. Predictions of
+# every occurrence are written to the store, one write per classifier and
+# batch, and term counts are merged into the state. Time spent featurizing,
+# classifying, tagging and counting terms goes to the given Timings
+def classify_pending(state, classifiers, featurizer, batch_size, tagger=None,
+                     pool=None, index=None, timings=None):
+  if timings is None:
+    timings = Timings()
+  if tagger is None:
+    tagger = Tagger()
+  if pool is None:
+    pool = ClassifierPool(classifiers)
+  if index is None:
+    index = SentenceIndex()
+
+  store   = state.store
+  pending = {cl.get_name(): set(state.pending(cl.get_name()))
+             for cl in classifiers}
+  todo    = set().union(*pending.values())
+  ids     = [x for x in state.article_ids() if x in todo]
+  failed  = set()
+  total   = 0
+
+  for batch in article_batches(store, ids, batch_size):
+    store_rows = np.concatenate([x for _, x in batch]).astype(np.int64)
+    sentences  = store.sentences(store_rows)
+    rows       = index.lookup(sentences)
+    total     += len(sentences)
+
+    # First position of each article in the batch
+    starts = np.cumsum([0] + [len(x) for _, x in batch])
+
+    # Positions of the articles each classifier has not seen yet, and the
+    # index rows among them it has no prediction for
+    jobs = []
+    for cl in classifiers:
+      name = cl.get_name()
+      todo = [i for i, (x, _) in enumerate(batch) if x in pending[name]]
+      if not todo or name in failed:
+        continue
+
+      positions = np.concatenate(
+        [np.arange(starts[i], starts[i + 1]) for i in todo]).astype(np.int64)
+      jobs.append((name, todo, positions, index.missing(name, rows[positions])))
+
+    # Featurize each missing distinct sentence once, from its first position
+    needed = np.unique(np.concatenate(
+      [np.zeros(0, dtype=np.int64)] + [x[3] for x in jobs]))
+    if len(needed) > 0:
+      batch_rows, first = np.unique(rows, return_index=True)
+      firsts   = first[np.searchsorted(batch_rows, needed)]
+      with timings.stage('featurize', len(needed)):
+        features = featurizer.transform(
+          pd.DataFrame({'sentence': [sentences[x] for x in firsts]}))
+
+      classify_jobs = [x for x in jobs if len(x[3]) > 0]
+      with timings.stage('classify', sum(len(x[3]) for x in classify_jobs)):
+        results = pool.classify(features,
+          [(name, np.searchsorted(needed, missing))
+           for name, _, _, missing in classify_jobs])
+
+      for (name, _, _, missing), predictions in zip(classify_jobs, results):
+        if isinstance(predictions, RuntimeError):
+          print(predictions, file=sys.stderr)
+          failed.add(name)
+          continue
+
+        index.set_predictions(name, missing, predictions)
+
+    jobs = [x for x in jobs if x[0] not in failed]
+
+    # Predictions of every occurrence, from the index
+    batch_predictions = {}
+    for name, todo, positions, _ in jobs:
+      predictions = index.get_predictions(name)[rows[positions]]
+      store.set_predictions(name, store_rows[positions], predictions)
+      batch_predictions[name] = (todo, positions, predictions)
+
+    # Tag every sentence predicted as CLASS by any classifier, once
+    tagged = [sentences[x] for _, positions, predictions in
+              batch_predictions.values() for x in positions[predictions == 0]]
+    with timings.stage('tag', len(tagged)):
+      tagger.tag(tagged)
+
+    # Split predictions back into articles and count their terms
+    with timings.stage('count_terms', len(tagged)):
+      for name, (todo, _, predictions) in batch_predictions.items():
+        predictions = predictions.tolist()
+
+        offset = 0
+        for i in todo:
+          article_id          = batch[i][0]
+          article_sentences   = sentences[starts[i]:starts[i + 1]]
+          article_predictions = predictions[offset:
+                                            offset + len(article_sentences)]
+          offset             += len(article_sentences)
+
+          state.add_terms(name, article_id,
+            count_terms(article_sentences, article_predictions, tagger))
+
+  if total:
+    print(f'{len(index)} distinct sentences out of {total}')
+
+  return failed
+
+# Relationship graph and histogram of a classifier's top terms, both fed
+# from the incidence of the top terms. The graph links each term to the
+# articles using it in path order, histogram bins cover the years of the
+# whole corpus
+def build_plots(state, name, top_terms, layout='auto'):
+  store     = state.store
+  ids       = store.article_ids()
+  incidence = state.incidence(name, top_terms)
+  rel_graph = RelGraph(name.upper(), layout)
+  histo     = Histogram(name.upper())
+
+  # Years of every top term counted in one product
+  first, last = 0, -1
+  if len(ids):
+    first = histo.first_year = int(store.years[ids].min())
+    last  = histo.last_year  = int(store.years[ids].max())
+  _, counts = incidence.year_counts(store.years, first, last)
+
+  for k, row in zip(top_terms, counts):
+    article_list = [Article(store, x) for x in
+                    sorted(incidence.articles(k).tolist(), key=state.get_path)]
+
+    rel_graph.link_concept(k.upper(), article_list)
+    histo.count_bins(k.upper(), first, row)
+
+  return rel_graph, histo
@@ -1,15 +1,87 @@
-import itertools
 import cairo
 import math
+import numpy as np
+
+# Graph layouts, rings draws each term with its own ring of articles and
+# network draws every article once, linked to all the terms it shares
+layouts = ('auto', 'rings', 'network')
+
+# Largest graph auto still lays out as rings
+max_ring_terms    = 20
+max_ring_articles = 300
+
+# Draws text centered on a point. The font face is selected once, and each
+# text is measured once per size
+class TextPainter:
+  def __init__(self, ctx):
+    self.ctx     = ctx
+    self.size    = None
+    self.extents = {}
+
+    ctx.select_font_face("Arial",
+      cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
+
+  def draw(self, text, x, y, size):
+    if size != self.size:
+      self.ctx.set_font_size(size)
+      self.size = size
+
+    extents = self.extents.get((text, size))
+    if extents is None:
+      (_, _, t_w, t_h, _, _) = self.ctx.text_extents(text)
+      extents = self.extents[(text, size)] = (t_w, t_h)
+
+    self.ctx.move_to(x - (extents[0] / 2.0), y + (extents[1] / 2.0))
+    self.ctx.show_text(text)
+
+# Force directed positions of n nodes in the unit square from symmetric
+# attraction weights, Fruchterman-Reingold with every pair computed at once.
+# Nodes start on a ring, so the layout is the same on every run
+def force_layout(weights, iterations=150, gravity=0.1):
+  n = len(weights)
+  if n == 1:
+    return np.full((1, 2), 0.5)
+
+  angles = np.arange(n) * (2.0 * math.pi / n)
+  pos    = 0.5 + 0.35 * np.column_stack((np.cos(angles), np.sin(angles)))
+  k      = 1.0 / math.sqrt(n)
+  step   = 0.1
+
+  for _ in range(iterations):
+    # Pairwise distances from the Gram matrix, no n by n by 2 deltas
+    sq   = (pos ** 2).sum(axis=1)
+    dist = sq[:, None] + sq[None, :] - 2.0 * (pos @ pos.T)
+    dist = np.sqrt(np.maximum(dist, 1e-8))
+
+    # Repulsion between all pairs, attraction along weighted edges and a
+    # pull towards the center keeping unlinked nodes in frame. Summing
+    # force * (pos_i - pos_j) over j is pos_i * sum(force) - force @ pos
+    force = (k * k / dist - weights * dist / k) / dist
+    np.fill_diagonal(force, 0.0)
+    disp  = pos * force.sum(axis=1)[:, None] - force @ pos
+    disp -= gravity * (pos - 0.5) / k
+
+    length = np.maximum(np.sqrt((disp ** 2).sum(axis=1)), 1e-9)
+    pos   += disp * (np.minimum(length, step) / length)[:, None]
+    step  *= 0.97
+
+  # Fit into the unit square keeping the aspect ratio
+  pos  -= (pos.min(axis=0) + pos.max(axis=0)) / 2.0
+  span  = np.abs(pos).max()
+  return 0.5 + pos * (0.5 / span if span > 0 else 1.0)
 
 class RelGraph:
-  def __init__(self, concept):
+  def __init__(self, concept, layout='auto'):
     self.concept     = concept
     self.subconcepts = dict()
     self.edges       = []
+    self.layout      = layout
 
+  # Only the id and label of each article are kept, so graphs can be sent
+  # to render workers without the corpus behind them
   def link_concept(self, subconcept, articles):
-    self.subconcepts[subconcept] = articles
+    self.subconcepts[subconcept] = [
+      (x.get_id(), x.get_name() + str(x.get_year())[-2:]) for x in articles]
 
   # Inner circle class for rendering
   class CairoCircle:
@@ -33,39 +105,12 @@ class RelGraph:
       ctx.arc(self.x, self.y, self.r, 0, 2 * math.pi)
       ctx.fill()
 
-      ctx.set_source_rgba(1.0, 1.0, 1.0, 1.0)
-      ctx.set_font_size(self.text_size)
-      ctx.select_font_face("Arial",
-        cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
-      (_, _, t_w, t_h, _, _) = ctx.text_extents(self.text)
-      ctx.move_to(self.x - (t_w / 2.0), self.y + (t_h / 2.0))
-      ctx.show_text(self.text)
-
-      ctx.set_source_rgba(1.0, 1.0, 1.0, 1.0)
-      ctx.set_font_size(self.sat_text_size)
-      ctx.select_font_face("Arial",
-        cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
-      (_, _, t_w, t_h, _, _) = ctx.text_extents(self.sat_text)
-      ctx.move_to(self.sat_text_x - (t_w / 2.0), self.sat_text_y + (t_h / 2.0))
-      ctx.show_text(self.sat_text)
-
-    def draw_text(self, ctx):
-      ctx.set_source_rgba(1.0, 1.0, 1.0, 1.0)
-      ctx.set_font_size(self.text_size)
-      ctx.select_font_face("Arial",
-        cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
-      (_, _, t_w, t_h, _, _) = ctx.text_extents(self.text)
-      ctx.move_to(self.x - (t_w / 2.0), self.y + (t_h / 2.0))
-      ctx.show_text(self.text)
-
-      ctx.set_source_rgba(1.0, 1.0, 1.0, 1.0)
-      ctx.set_font_size(self.sat_text_size)
-      ctx.select_font_face("Arial",
-        cairo.FONT_SLANT_NORMAL, cairo.FONT_WEIGHT_BOLD)
-      (_, _, t_w, t_h, _, _) = ctx.text_extents(self.sat_text)
-      ctx.move_to(self.sat_text_x - (t_w / 2.0), self.sat_text_y + (t_h / 2.0))
-      ctx.show_text(self.sat_text)
-
+    def draw_text(self, painter):
+      if self.text:
+        painter.draw(self.text, self.x, self.y, self.text_size)
+      if self.sat_text:
+        painter.draw(self.sat_text, self.sat_text_x, self.sat_text_y,
+                     self.sat_text_size)
 
     def get_center(self):
       return (self.x, self.y)
@@ -83,15 +128,50 @@ class RelGraph:
     ctx.line_to(c1_c[0], c1_c[1])
     ctx.stroke()
 
-  def cairo_render(self, pathname, side):
-    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, side, side)
+  # Layout used for 'auto', rings until the graph gets too big to read
+  def pick_layout(self):
+    if self.layout != 'auto':
+      return self.layout
+
+    links = sum(len(x) for x in self.subconcepts.values())
+    if (len(self.subconcepts) <= max_ring_terms and
+        links <= max_ring_articles):
+      return 'rings'
+    return 'network'
+
+  # Render to pathname.fmt, fmt is either png or svg
+  def cairo_render(self, pathname, side, fmt='png'):
+    if fmt == 'svg':
+      surface = cairo.SVGSurface(f'{pathname}.svg', side, side)
+    else:
+      surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, side, side)
     context = cairo.Context(surface)
     context.scale(side, side)
 
-    # Main, sub, and article colors
-    main_rgba      = (3.0 / 255.0,  121.0 / 255.0, 1.0,           1.0)
-    sub_rgba       = (70.0 / 255.0, 3.0 / 255.0,   1.0,           1.0)
-    art_rgba       = (3.0 / 255.0,  1.0,           137.0 / 255.0, 1.0)
+    if self.subconcepts and self.pick_layout() == 'network':
+      self.draw_network(context, side)
+    elif self.subconcepts:
+      self.draw_rings(context)
+
+    # Write PNG, SVG surfaces write as they are drawn
+    if fmt == 'svg':
+      surface.finish()
+    else:
+      surface.write_to_png(f'{pathname}.png')
+
+    return f'{pathname}.{fmt}'
+
+  # Main, sub, and article colors
+  main_rgba = (3.0 / 255.0,  121.0 / 255.0, 1.0,           1.0)
+  sub_rgba  = (70.0 / 255.0, 3.0 / 255.0,   1.0,           1.0)
+  art_rgba  = (3.0 / 255.0,  1.0,           137.0 / 255.0, 1.0)
+
+  # Terms evenly on a ring around the main concept, each with its own ring
+  # of articles
+  def draw_rings(self, context):
+    main_rgba = self.main_rgba
+    sub_rgba  = self.sub_rgba
+    art_rgba  = self.art_rgba
 
     # Main and sub text sizes
     main_txts = 0.06
@@ -139,9 +219,8 @@ class RelGraph:
         circles[0], circles[sub_id])
 
       # Add articles around subconcept
-      art_r          = min(min_art_r, 3.0 * sub_r / float(len(articles)))
-      sub_angle_step = (math.pi * 2.0) / float(len(articles))
-      for j, article in enumerate(articles):
+      sub_angle_step = (math.pi * 2.0) / float(max(len(articles), 1))
+      for j, (_, label) in enumerate(articles):
         # Append article circle
         art_x  = sub_x + ((sub_r + sub_b) * math.cos(sub_angle_step * j))
         art_y  = sub_y + ((sub_r + sub_b) * math.sin(sub_angle_step * j))
@@ -149,7 +228,7 @@ class RelGraph:
         art_id = circle_id
         circles[circle_id] = self.CairoCircle(art_x, art_y, min_art_r,
           art_rgba, sat_txt_x=art_x, sat_txt_y=art_y,
-          sat_txt=article.get_name() + str(article.get_year())[-2:],
+          sat_txt=label,
           sat_txt_size=sat_txts)
         circle_id += 1
 
@@ -157,11 +236,136 @@ class RelGraph:
         self.draw_edge(context, art_rgba, sub_width,
           circles[sub_id], circles[art_id])
 
-    # Draw all circles
+    # Draw all circles, then all text on top of them
     for circle in circles.values():
       circle.draw_circle(context)
+
+    painter = TextPainter(context)
+    context.set_source_rgba(1.0, 1.0, 1.0, 1.0)
     for circle in circles.values():
-      circle.draw_text(context)
+      circle.draw_text(painter)
+
+  # Term by article incidence, as a dense matrix, and the article labels
+  def incidence(self):
+    columns = {}
+    labels  = []
+    for articles in self.subconcepts.values():
+      for article_id, label in articles:
+        if article_id not in columns:
+          columns[article_id] = len(labels)
+          labels.append(label)
+
+    links = np.zeros((len(self.subconcepts), len(labels)), dtype=np.float32)
+    for i, articles in enumerate(self.subconcepts.values()):
+      links[i, [columns[x] for x, _ in articles]] = 1.0
+
+    return links, labels
+
+  # Every article drawn once and linked to all of its terms. Terms are laid
+  # out by force, pulled together by the articles they share, around the
+  # main concept in the center. Articles of a single term ring it, shared
+  # ones sit between their terms
+  def draw_network(self, context, side):
+    links, labels = self.incidence()
+    n_terms, n_articles = links.shape
+    terms  = list(self.subconcepts)
+    degree = links.sum(axis=0)
+
+    # Terms sharing more articles attract more, every term is also drawn to
+    # the main concept through the center
+    shared  = links @ links.T
+    np.fill_diagonal(shared, 0.0)
+    weights = np.log1p(shared) / max(np.log1p(shared.max()), 1.0)
+    term_xy = force_layout(weights)
+
+    # Leave room at the borders and in the center for the main concept
+    main_r  = min(0.12, 0.6 / math.sqrt(n_terms + 4))
+    term_xy = 0.5 + (term_xy - 0.5) * 0.8
+    offset  = term_xy - 0.5
+    dist    = np.maximum(np.sqrt((offset ** 2).sum(axis=1)), 1e-9)
+    term_xy = 0.5 + offset * (np.maximum(dist, 2.0 * main_r) / dist)[:, None]
+
+    # Term radius by number of articles, articles scaled to fit the terms
+    spacing = 0.7 / math.sqrt(n_terms)
+    sub_r   = spacing * 0.25 * np.sqrt(links.sum(axis=1) /
+                                       max(links.sum(axis=1).max(), 1.0))
+    sub_r   = np.maximum(sub_r, spacing * 0.08)
+    art_r   = min(0.012, 0.5 / math.sqrt(n_articles + 1) * 0.2)
+
+    # Shared articles at the mean of their terms, jittered along a golden
+    # angle spiral so they do not stack
+    art_xy = (links.T @ term_xy) / np.maximum(degree, 1.0)[:, None]
+    golden = np.arange(n_articles) * (math.pi * (3.0 - math.sqrt(5.0)))
+    spread = art_r * 2.0 * np.sqrt(np.arange(n_articles) % 50)
+    art_xy += np.column_stack((np.cos(golden), np.sin(golden))) * \
+              spread[:, None] * (degree > 1)[:, None]
+
+    # Articles of one term on rings around it, growing outwards when a ring
+    # is full
+    single     = np.flatnonzero(degree == 1)
+    owner      = links[:, single].argmax(axis=0)
+    order      = np.argsort(owner, kind='stable')
+    single     = single[order]
+    owner      = owner[order]
+    firsts     = np.searchsorted(owner, owner)
+    rank       = np.arange(len(single)) - firsts
+    per_ring   = np.maximum((2.0 * math.pi * (sub_r[owner] + art_r * 2.0) /
+                             (art_r * 2.5)).astype(int), 6)
+    ring       = rank // per_ring
+    angle      = (rank % per_ring) * (2.0 * math.pi / per_ring) + ring * 0.5
+    radius     = sub_r[owner] + art_r * (2.0 + 2.5 * ring)
+    art_xy[single] = term_xy[owner] + \
+                     np.column_stack((np.cos(angle), np.sin(angle))) * \
+                     radius[:, None]
+
+    # Edges as one path per kind, stroked once
+    main_width = min(0.01, main_r * 0.1)
+    sub_width  = max(art_r * 0.15, 0.5 / side)
+
+    context.set_source_rgba(*self.art_rgba[:3], 0.35)
+    context.set_line_width(sub_width)
+    term_idx, art_idx = np.nonzero(links)
+    for (x0, y0), (x1, y1) in zip(term_xy[term_idx].tolist(),
+                                  art_xy[art_idx].tolist()):
+      context.move_to(x0, y0)
+      context.line_to(x1, y1)
+    context.stroke()
+
+    context.set_source_rgba(*self.sub_rgba)
+    context.set_line_width(main_width)
+    for x, y in term_xy.tolist():
+      context.move_to(0.5, 0.5)
+      context.line_to(x, y)
+    context.stroke()
+
+    # Circles as one path per kind, filled once
+    context.set_source_rgba(*self.art_rgba)
+    for x, y in art_xy.tolist():
+      context.new_sub_path()
+      context.arc(x, y, art_r, 0, 2 * math.pi)
+    context.fill()
+
+    context.set_source_rgba(*self.sub_rgba)
+    for (x, y), r in zip(term_xy.tolist(), sub_r.tolist()):
+      context.new_sub_path()
+      context.arc(x, y, r, 0, 2 * math.pi)
+    context.fill()
+
+    context.set_source_rgba(*self.main_rgba)
+    context.arc(0.5, 0.5, main_r, 0, 2 * math.pi)
+    context.fill()
+
+    # Labels too small to read at this side are left out
+    painter = TextPainter(context)
+    context.set_source_rgba(1.0, 1.0, 1.0, 1.0)
+    painter.draw(self.concept, 0.5, 0.5, main_r * 0.3)
+
+    for term, (x, y), r in zip(terms, term_xy.tolist(), sub_r.tolist()):
+      size = min(3.0 * r / max(len(term), 1), r * 0.6)
+      if size * side >= 4:
+        painter.draw(term, x, y, size)
 
-    # Write PNG
-    surface.write_to_png(f'{pathname}.png')
+    art_txts = art_r * 0.27
+    if art_txts * side >= 4:
+      for label, (x, y) in zip(labels, art_xy.tolist()):
+        painter.draw(label, x, y, art_txts)
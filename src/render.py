@@ -0,0 +1,39 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Output sizes, a graph is graph_side pixels square and a histogram is
+# hist_size inches at hist_dpi
+presets = {
+  'full':  {'graph_side': 2160, 'hist_size': (32, 18), 'hist_dpi': 300},
+  'draft': {'graph_side': 1080, 'hist_size': (16, 9),  'hist_dpi': 100},
+  'thumb': {'graph_side': 540,  'hist_size': (8, 4.5), 'hist_dpi': 72},
+}
+
+formats = ('png', 'svg')
+
+# Render a RelGraph or a Histogram, returns (path, seconds, error) where
+# error is None or the repr of what was raised
+def render_plot(job, preset='full', fmt='png'):
+  kind, plot, pathname = job
+  size  = presets[preset]
+  start = time.perf_counter()
+
+  try:
+    if kind == 'graph':
+      path = plot.cairo_render(pathname, size['graph_side'], fmt)
+    else:
+      path = plot.plot(pathname, size['hist_size'], size['hist_dpi'], fmt)
+  except Exception as e:
+    return f'{pathname}.{fmt}', time.perf_counter() - start, repr(e)
+
+  return path, time.perf_counter() - start, None
+
+# Render (kind, plot, pathname) jobs, kind being 'graph' or 'histogram',
+# in a process pool when workers > 1. Results come in job order
+def render_plots(jobs, workers=1, preset='full', fmt='png'):
+  if not workers or workers <= 1 or len(jobs) <= 1:
+    return [render_plot(x, preset, fmt) for x in jobs]
+
+  with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+    return list(pool.map(render_plot, jobs, [preset] * len(jobs),
+                         [fmt] * len(jobs)))
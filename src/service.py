@@ -0,0 +1,299 @@
+import os
+import json
+import tempfile
+import threading
+import socketserver
+import pandas as pd
+from http.server  import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from labelers import Label
+from article  import parse_path
+from pipeline import build_plots
+from render   import render_plot, presets, formats
+from relgraph import layouts
+from terms    import load_stopwords
+
+content_types = {
+  'png':  'image/png',
+  'svg':  'image/svg+xml',
+  'csv':  'text/csv',
+  'json': 'application/json',
+}
+
+# Raised for requests that cannot be answered, with the HTTP status to send
+class RequestError(Exception):
+  def __init__(self, message, status=400):
+    super().__init__(message)
+    self.status = status
+
+# The corpus state, classifiers and term aggregates of a run, kept warm to
+# answer requests. update(pdf_paths) extracts and classifies new articles
+# into the state, rescanning the articles directory when pdf_paths is None.
+# Requests are answered one at a time under a lock, so the state is never
+# read while it is updated
+class AnalysisService:
+  def __init__(self, args, timings, state, classifiers, featurizer,
+               update, compiled=None):
+    self.args        = args
+    self.timings     = timings
+    self.state       = state
+    self.classifiers = {cl.get_name(): cl for cl in classifiers}
+    self.featurizer  = featurizer
+    self.compiled    = compiled
+    self.update      = update
+    self.stopwords   = load_stopwords(args.stopwords)
+    self.lock        = threading.Lock()
+
+    self.routes = {
+      ('GET',  '/status'):    self.status,
+      ('GET',  '/terms'):     self.terms,
+      ('GET',  '/shared'):    self.shared,
+      ('GET',  '/graph'):     self.graph,
+      ('GET',  '/histogram'): self.histogram,
+      ('POST', '/classify'):  self.classify,
+      ('POST', '/articles'):  self.articles,
+    }
+
+  # Answer a request, returns (content type, body bytes)
+  def handle(self, method, path, params):
+    route = self.routes.get((method, path))
+    if route is None:
+      raise RequestError(f'No {method} {path}', 404)
+
+    with self.lock, self.timings.stage(f'serve{path}', 1):
+      result = route(params)
+
+    if isinstance(result, tuple):
+      return result
+    return content_types['json'], json.dumps(result).encode('utf-8')
+
+  def label_set(self, params):
+    name = params.get('label_set')
+    if name not in self.classifiers:
+      raise RequestError(f'Unknown label set {name!r}, one of: '
+                         f'{", ".join(self.classifiers)}')
+    if not self.state.classified.get(name):
+      raise RequestError(f'No articles classified with {name}', 409)
+
+    return name
+
+  def top_terms(self, name, params):
+    return self.state.get_stats(name).top_k(
+      int(params.get('top', self.args.top)), min_df=3,
+      stopwords=self.stopwords)
+
+  def status(self, params):
+    return {
+      'articles':   len(self.state.records),
+      'sentences':  len(self.state.store),
+      'kept':       int(self.state.store.keep.sum()),
+      'classified': {x: len(self.state.classified.get(x, ()))
+                     for x in self.classifiers},
+      'compiled':   self.compiled is not None,
+    }
+
+  # Top terms of a label set with the number of articles using each
+  def terms(self, params):
+    name  = self.label_set(params)
+    stats = self.state.get_stats(name)
+
+    return {'label_set': name,
+            'terms':     [{'term': x, 'articles': stats.doc_freq(x)}
+                          for x in self.top_terms(name, params)]}
+
+  # Articles using all of the comma separated terms
+  def shared(self, params):
+    name      = self.label_set(params)
+    terms     = [x.strip().lower() for x in params.get('terms', '').split(',')
+                 if x.strip()]
+    incidence = self.state.incidence(name)
+    missing   = [x for x in terms if x not in incidence.index]
+    if not terms or missing:
+      raise RequestError(f'Terms not found with {name}: {", ".join(missing)}',
+                         404)
+
+    ids = sorted(incidence.shared_articles(terms).tolist(),
+                 key=self.state.get_path)
+    return {'label_set': name, 'terms': terms,
+            'articles':  [self.state.get_path(x) for x in ids]}
+
+  def graph(self, params):
+    return self.plot('graph', params)
+
+  def histogram(self, params):
+    return self.plot('histogram', params)
+
+  # Render a plot of a label set's top terms. Histogram counts can be asked
+  # for as csv or json, which renders nothing
+  def plot(self, kind, params):
+    name   = self.label_set(params)
+    fmt    = params.get('format', 'png')
+    preset = params.get('preset', 'draft')
+    layout = params.get('layout', self.args.graph_layout)
+    counts = kind == 'histogram' and fmt in ('csv', 'json')
+    if fmt not in formats and not counts:
+      raise RequestError(f'Unknown format {fmt!r}')
+    if preset not in presets:
+      raise RequestError(f'Unknown preset {preset!r}')
+    if layout not in layouts:
+      raise RequestError(f'Unknown layout {layout!r}')
+
+    rel_graph, histo = build_plots(self.state, name,
+                                   self.top_terms(name, params), layout)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      pathname = os.path.join(tmp_dir, f'{name}_{kind}')
+      if counts:
+        path = histo.export(pathname, fmt)
+      else:
+        path, _, error = render_plot(
+          (kind, rel_graph if kind == 'graph' else histo, pathname),
+          preset, fmt)
+        if error:
+          raise RequestError(f'Could not render {kind}. {error}', 500)
+
+      with open(path, 'rb') as f:
+        return content_types[fmt], f.read()
+
+  # Predictions of the given label sets, all by default, for sentences. A
+  # single sentence skips the sparse matrix with compiled models
+  def classify(self, params):
+    sentences = params.get('sentences')
+    names     = params.get('label_sets') or list(self.classifiers)
+    if (not isinstance(sentences, list) or
+        not all(isinstance(x, str) for x in sentences)):
+      raise RequestError('sentences must be a list of strings')
+    unknown = [x for x in names if x not in self.classifiers]
+    if unknown:
+      raise RequestError(f'Unknown label sets: {", ".join(unknown)}')
+    if not sentences:
+      return {x: [] for x in names}
+
+    dataset = pd.DataFrame({'sentence': sentences})
+    if self.compiled is not None and len(sentences) == 1:
+      predictions = self.compiled.classify_sentence(sentences[0])
+      predictions = {x: [predictions[x]] for x in names}
+    elif self.compiled is not None:
+      scores      = self.compiled.scores(self.compiled.transform(dataset))
+      predictions = {x: self.compiled.predict(x, scores) for x in names}
+    else:
+      features    = self.featurizer.transform(dataset)
+      predictions = {x: self.classifiers[x].classify(None, features)
+                     for x in names}
+
+    labels = {x.value: x.name for x in Label}
+    return {x: [labels.get(int(y), str(y)) for y in predictions[x]]
+            for x in names}
+
+  # Add pdfs by path, or rescan the articles directory without paths. New
+  # articles are extracted and classified, and term aggregates updated
+  def articles(self, params):
+    paths = params.get('paths')
+    if paths is not None:
+      if (not isinstance(paths, list) or
+          not all(isinstance(x, str) for x in paths)):
+        raise RequestError('paths must be a list of strings')
+      missing = [x for x in paths if not os.path.isfile(x)]
+      if missing:
+        raise RequestError(f'No such files: {", ".join(missing)}', 404)
+      for path in paths:
+        try:
+          parse_path(path)
+        except ValueError:
+          raise RequestError(f'{path} is not named like name_year.pdf')
+      paths = [self.article_path(x) for x in paths]
+
+    changes = self.update(paths)
+    if changes is None:
+      raise RequestError('Could not extract articles', 500)
+
+    added, removed = changes
+    return {'added': added, 'removed': removed,
+            'articles': len(self.state.records)}
+
+  # Paths in the articles directory are spelled like a scan of it, so an
+  # article is never recorded twice
+  def article_path(self, path):
+    if os.path.samefile(os.path.dirname(os.path.abspath(path)),
+                        self.args.articles):
+      return f'{self.args.articles}/{os.path.basename(path)}'
+    return os.path.abspath(path)
+
+# Routes requests to the AnalysisService of its server. Query parameters
+# and json object bodies both become request parameters
+class ServiceHandler(BaseHTTPRequestHandler):
+  def do_GET(self):
+    self.respond('GET')
+
+  def do_POST(self):
+    self.respond('POST')
+
+  def respond(self, method):
+    url    = urlsplit(self.path)
+    params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+    status = 200
+    try:
+      length = int(self.headers.get('Content-Length') or 0)
+      if length:
+        body = json.loads(self.rfile.read(length))
+        if not isinstance(body, dict):
+          raise RequestError('Body must be a json object')
+        params.update(body)
+
+      content_type, body = self.server.service.handle(method, url.path,
+                                                      params)
+    except RequestError as e:
+      status, error = e.status, str(e)
+    except ValueError as e:
+      status, error = 400, repr(e)
+    except Exception as e:
+      status, error = 500, repr(e)
+
+    if status != 200:
+      content_type = content_types['json']
+      body         = json.dumps({'error': error}).encode('utf-8')
+
+    self.send_response(status)
+    self.send_header('Content-Type', content_type)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  # Unix socket clients have no address
+  def address_string(self):
+    if isinstance(self.client_address, tuple) and self.client_address:
+      return str(self.client_address[0])
+    return 'local'
+
+  def log_message(self, format, *args):
+    self.server.service.timings.log('request', client=self.address_string(),
+                                    message=format % args)
+
+class UnixHTTPServer(socketserver.UnixStreamServer):
+  pass
+
+# Serve until interrupted, on a Unix socket when socket_path is given,
+# otherwise over TCP on host and port
+def serve(service, host='127.0.0.1', port=8765, socket_path=None):
+  if socket_path:
+    if os.path.exists(socket_path):
+      os.remove(socket_path)
+    server  = UnixHTTPServer(socket_path, ServiceHandler)
+    address = socket_path
+  else:
+    server  = HTTPServer((host, port), ServiceHandler)
+    address = f'http://{host}:{server.server_address[1]}'
+
+  server.service = service
+  print(f'Serving on {address}, Ctrl-C to stop')
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    if socket_path and os.path.exists(socket_path):
+      os.remove(socket_path)
+
+  return True
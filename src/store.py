@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import mmap
+import uuid
+import struct
+import hashlib
+import numpy as np
+
+from dedup import UNKNOWN
+from files import atomic_write
+
+# Bump whenever the on-disk layout of a saved store changes
+STORE_VERSION = 1
+STORE_MAGIC   = b'ARTSTORE'
+
+# Magic, version, header length. The json header follows, then every array
+# and the text buffer, each aligned to ALIGNMENT bytes
+HEADER_FORMAT = '<8sIQ'
+ALIGNMENT     = 64
+
+ROW_COLUMNS     = ('offsets', 'article', 'year', 'keep', 'predictions')
+ARTICLE_COLUMNS = ('years', 'starts', 'ends', 'alive')
+
+# Columnar store of every sentence in the corpus. Sentence text lives in one
+# utf-8 buffer delimited by an offsets array, and each sentence has an
+# article id, a year, a filter flag and one int8 prediction per label set.
+# Articles are contiguous row ranges, their ids are never reused. Removed
+# articles leave dead rows behind until compact() is called
+class SentenceStore:
+  def __init__(self):
+    # Sentence columns, offsets has one more entry than there are sentences
+    self.text        = bytearray()
+    self.offsets     = np.zeros(1, dtype=np.int64)
+    self.article     = np.zeros(0, dtype=np.int32)
+    self.year        = np.zeros(0, dtype=np.int16)
+    self.keep        = np.zeros(0, dtype=bool)
+    self.predictions = np.zeros((0, 0), dtype=np.int8)
+    self.label_sets  = []
+
+    # Article columns, indexed by article id
+    self.paths  = []
+    self.names  = []
+    self.years  = np.zeros(0, dtype=np.int16)
+    self.starts = np.zeros(0, dtype=np.int64)
+    self.ends   = np.zeros(0, dtype=np.int64)
+    self.alive  = np.zeros(0, dtype=bool)
+
+    # Appended columns not concatenated into the arrays yet
+    self.chunks = []
+
+    # Memory map the columns point into when opened from a file, the file
+    # path and whether anything changed since it was opened or saved
+    self.map        = None
+    self.source     = None
+    self.generation = None
+    self.modified   = False
+
+  def __getstate__(self):
+    self.flush()
+    self.own()
+    return self.__dict__
+
+  # Copy mapped columns into memory before they are modified
+  def own(self):
+    self.modified = True
+    if self.map is None:
+      return
+
+    self.text = bytearray(self.text)
+    for name in ROW_COLUMNS + ARTICLE_COLUMNS:
+      setattr(self, name, np.array(getattr(self, name)))
+    self.map = None
+
+  # Write the store to a single memory-mappable file, atomically. Nothing is
+  # written if the store is unchanged since it was opened from or saved to
+  # the same path
+  def save(self, path):
+    self.flush()
+    if not self.modified and self.source == path and os.path.isfile(path):
+      return self.generation
+
+    generation = uuid.uuid4().hex
+    header     = {'generation': generation, 'paths': self.paths,
+                  'names': self.names, 'label_sets': self.label_sets,
+                  'arrays': {}}
+
+    # Lay out the arrays and the text buffer after the header
+    blocks = [(x, np.ascontiguousarray(getattr(self, x)))
+              for x in ROW_COLUMNS + ARTICLE_COLUMNS]
+    blocks.append(('text', memoryview(self.text)))
+
+    # Offsets depend on the header length, which depends on the offsets
+    # written in it, so lay out until the header size is stable
+    header_len = 0
+    while True:
+      offset = align(struct.calcsize(HEADER_FORMAT) + header_len)
+      for name, block in blocks:
+        if name == 'text':
+          header['arrays'][name] = ['|u1', [block.nbytes], offset]
+        else:
+          header['arrays'][name] = [block.dtype.str, list(block.shape), offset]
+        offset = align(offset + block.nbytes)
+
+      encoded = json.dumps(header).encode('utf-8')
+      if len(encoded) == header_len:
+        break
+      header_len = len(encoded)
+
+    def write(f):
+      f.write(struct.pack(HEADER_FORMAT, STORE_MAGIC, STORE_VERSION,
+                          header_len))
+      f.write(encoded)
+      for name, block in blocks:
+        f.write(b'\0' * (header['arrays'][name][2] - f.tell()))
+        f.write(block)
+
+    atomic_write(path, write)
+
+    self.source     = path
+    self.generation = generation
+    self.modified   = False
+
+    return generation
+
+  # Open a saved store without reading it into memory. Columns are read-only
+  # views of a shared memory map, so processes opening the same file share
+  # its pages, and are only copied if the store is modified. Returns None if
+  # the file is missing or not a valid store
+  @staticmethod
+  def open(path):
+    try:
+      with open(path, 'rb') as f:
+        magic, version, header_len = struct.unpack(
+          HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+          return None
+
+        header = json.loads(f.read(header_len).decode('utf-8'))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, struct.error) as e:
+      print(f'Could not open sentence store. {repr(e)}', file=sys.stderr)
+      return None
+
+    store = SentenceStore()
+    store.paths      = header['paths']
+    store.names      = header['names']
+    store.label_sets = header['label_sets']
+
+    for name, (dtype, shape, offset) in header['arrays'].items():
+      count = int(np.prod(shape))
+      if name == 'text':
+        store.text = memoryview(mapped)[offset:offset + count]
+      elif count == 0:
+        setattr(store, name, np.zeros(shape, dtype=dtype))
+      else:
+        setattr(store, name, np.frombuffer(mapped, dtype=dtype, count=count,
+                                           offset=offset).reshape(shape))
+
+    store.map        = mapped
+    store.source     = path
+    store.generation = header['generation']
+
+    return store
+
+  def __len__(self):
+    self.flush()
+    return len(self.article)
+
+  # Append an article with its sentences and their filter flags, returns the
+  # new article id
+  def add(self, path, name, year, sentences, keep):
+    self.own()
+
+    article_id = len(self.paths)
+    encoded    = [x.encode('utf-8') for x in sentences]
+    lengths    = np.fromiter((len(x) for x in encoded), dtype=np.int64,
+                             count=len(encoded))
+
+    self.paths.append(path)
+    self.names.append(name)
+    self.text.extend(b''.join(encoded))
+    self.chunks.append((article_id, year, lengths,
+                        np.asarray(keep, dtype=bool)))
+
+    return article_id
+
+  # Concatenate appended articles into the column arrays
+  def flush(self):
+    if not self.chunks:
+      return
+
+    rows    = len(self.article)
+    added   = sum(len(x[2]) for x in self.chunks)
+    lengths = np.concatenate([x[2] for x in self.chunks])
+    counts  = np.array([len(x[2]) for x in self.chunks], dtype=np.int64)
+    ids     = np.array([x[0] for x in self.chunks], dtype=np.int32)
+    years   = np.array([x[1] for x in self.chunks], dtype=np.int16)
+
+    starts = rows + np.concatenate([[0], np.cumsum(counts)[:-1]])
+    self.offsets = np.concatenate(
+      [self.offsets, self.offsets[-1] + np.cumsum(lengths)])
+    self.article = np.concatenate([self.article, np.repeat(ids, counts)])
+    self.year    = np.concatenate([self.year, np.repeat(years, counts)])
+    self.keep    = np.concatenate([self.keep] + [x[3] for x in self.chunks])
+    self.predictions = np.concatenate([self.predictions,
+      np.full((added, len(self.label_sets)), UNKNOWN, dtype=np.int8)])
+
+    self.years  = np.concatenate([self.years, years])
+    self.starts = np.concatenate([self.starts, starts])
+    self.ends   = np.concatenate([self.ends, starts + counts])
+    self.alive  = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+
+    self.chunks = []
+
+  def remove(self, article_id):
+    self.flush()
+    self.own()
+    self.alive[article_id] = False
+
+  def dead_rows(self):
+    self.flush()
+    return int(np.count_nonzero(~self.alive[self.article]))
+
+  # Drop the rows of removed articles, article ids stay the same
+  def compact(self):
+    self.flush()
+    live = self.alive[self.article]
+    if live.all():
+      return
+
+    self.own()
+    rows    = np.flatnonzero(live)
+    lengths = np.diff(self.offsets)[rows]
+
+    # Surviving articles are copied a row range at a time
+    text = bytearray()
+    for article_id in np.flatnonzero(self.alive):
+      start, end = self.starts[article_id], self.ends[article_id]
+      text.extend(self.text[self.offsets[start]:self.offsets[end]])
+
+    self.text        = text
+    self.offsets     = np.concatenate([[0], np.cumsum(lengths)])
+    self.article     = self.article[rows]
+    self.year        = self.year[rows]
+    self.keep        = self.keep[rows]
+    self.predictions = self.predictions[rows]
+
+    # Rows of each surviving article are still contiguous and in order
+    counts      = np.bincount(self.article, minlength=len(self.paths))
+    self.ends   = np.cumsum(counts)
+    self.starts = self.ends - counts
+
+  def article_ids(self):
+    self.flush()
+    return np.flatnonzero(self.alive)
+
+  def get_path(self, article_id):
+    return self.paths[article_id]
+
+  def get_name(self, article_id):
+    return self.names[article_id]
+
+  def get_year(self, article_id):
+    self.flush()
+    return int(self.years[article_id])
+
+  def article_rows(self, article_id):
+    self.flush()
+    return np.arange(self.starts[article_id], self.ends[article_id])
+
+  # Rows of an article's sentences that passed the filter
+  def kept_rows(self, article_id):
+    rows = self.article_rows(article_id)
+    return rows[self.keep[rows]]
+
+  def sentence(self, row):
+    self.flush()
+    return str(self.text[self.offsets[row]:self.offsets[row + 1]], 'utf-8')
+
+  def sentences(self, rows):
+    self.flush()
+    rows   = np.asarray(rows, dtype=np.int64)
+    text   = self.text
+    starts = self.offsets[rows].tolist()
+    ends   = self.offsets[rows + 1].tolist()
+
+    return [str(text[x:y], 'utf-8') for x, y in zip(starts, ends)]
+
+  # Digest of the sentences and filter flags of articles, in the given
+  # order, hashed from the text buffer without decoding it
+  def digest(self, article_ids):
+    self.flush()
+    digest = hashlib.sha256()
+    for article_id in article_ids:
+      start, end = self.starts[article_id], self.ends[article_id]
+      digest.update(self.text[self.offsets[start]:self.offsets[end]])
+      digest.update(np.diff(self.offsets[start:end + 1]).tobytes())
+      digest.update(self.keep[start:end].tobytes())
+
+    return digest.hexdigest()
+
+  def label_column(self, name):
+    self.flush()
+    if name not in self.label_sets:
+      self.own()
+      self.label_sets.append(name)
+      self.predictions = np.concatenate([self.predictions,
+        np.full((len(self.article), 1), UNKNOWN, dtype=np.int8)], axis=1)
+
+    return self.label_sets.index(name)
+
+  def get_predictions(self, name, rows):
+    column = self.label_column(name)
+    return self.predictions[rows, column]
+
+  def set_predictions(self, name, rows, predictions):
+    column = self.label_column(name)
+    self.own()
+    self.predictions[rows, column] = predictions
+
+  def clear_predictions(self, name):
+    column = self.label_column(name)
+    self.own()
+    self.predictions[:, column] = UNKNOWN
+
+# Round an offset up to the next multiple of ALIGNMENT
+def align(offset):
+  return -(-offset // ALIGNMENT) * ALIGNMENT
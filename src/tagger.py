@@ -0,0 +1,79 @@
+import re
+import nltk
+from concurrent.futures import ProcessPoolExecutor
+
+from dedup import normalize
+
+# Split a sentence into the lowercase tokens terms are counted over
+def tokenize(sentence):
+  filtered_sentence = re.sub(r'[^\w\s]', '', sentence.lower(), re.UNICODE)
+  return nltk.word_tokenize(filtered_sentence)
+
+# Tokens and POS tags for a list of sentences, tagged in one batch
+def tag_sentences(sentences):
+  toks = [tokenize(x) for x in sentences]
+  tags = nltk.pos_tag_sents(toks)
+
+  return [(x, [tag for _, tag in y]) for x, y in zip(toks, tags)]
+
+# Tokenizes and POS tags each distinct sentence once, however many
+# classifiers or articles ask for it. Sentences equal once normalized share
+# their tokens and tags. Batches of sentences are tagged with pos_tag_sents,
+# spread over a process pool when workers > 1
+class Tagger:
+  def __init__(self, workers=1, chunk_size=256, cache_size=1 << 18):
+    self.workers    = workers or 1
+    self.chunk_size = chunk_size
+    self.cache_size = cache_size
+    self.cache      = {}
+    self.pool       = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    if self.pool:
+      self.pool.shutdown()
+      self.pool = None
+
+  # Make sure all given sentences are in the cache
+  def tag(self, sentences):
+    missing = {}
+    for sentence in sentences:
+      key = normalize(sentence)
+      if key not in self.cache and key not in missing:
+        missing[key] = sentence
+    if not missing:
+      return
+
+    keys    = list(missing)
+    missing = list(missing.values())
+
+    chunks = [missing[i:i + self.chunk_size]
+              for i in range(0, len(missing), self.chunk_size)]
+
+    if self.workers > 1 and len(chunks) > 1:
+      if self.pool is None:
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+      results = self.pool.map(tag_sentences, chunks)
+    else:
+      results = map(tag_sentences, chunks)
+
+    if len(self.cache) + len(missing) > self.cache_size:
+      self.cache = {}
+
+    offset = 0
+    for chunk, tagged in zip(chunks, results):
+      self.cache.update(zip(keys[offset:offset + len(chunk)], tagged))
+      offset += len(chunk)
+
+  # (tokens, tags) of a sentence
+  def get(self, sentence):
+    key = normalize(sentence)
+    if key not in self.cache:
+      self.tag([sentence])
+
+    return self.cache[key]
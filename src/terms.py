@@ -0,0 +1,56 @@
+import heapq
+from array       import array
+from collections import Counter
+
+# Stopwords file, one word per line
+def load_stopwords(path):
+  with open(path, 'r') as c:
+    return frozenset(x.strip() for x in c)
+
+# Term statistics of one classifier over the corpus: for every term, the
+# postings list of the ids of the articles using it. A term's document
+# frequency is the length of its postings
+class TermStats:
+  def __init__(self):
+    self.postings = {}
+
+  def __len__(self):
+    return len(self.postings)
+
+  def add(self, article_id, terms):
+    for term in terms:
+      postings = self.postings.get(term)
+      if postings is None:
+        postings = self.postings[term] = array('l')
+      postings.append(article_id)
+
+  def remove(self, article_id, terms):
+    for term in terms:
+      postings = self.postings.get(term)
+      if postings is None:
+        continue
+
+      try:
+        postings.remove(article_id)
+      except ValueError:
+        continue
+
+      if not postings:
+        del self.postings[term]
+
+  def get_postings(self, term):
+    return self.postings.get(term, array('l'))
+
+  def doc_freq(self, term):
+    return len(self.postings.get(term, ()))
+
+  def doc_freqs(self):
+    return Counter({k: len(v) for k, v in self.postings.items()})
+
+  # The k terms used by most articles, skipping stopwords and terms used by
+  # less than min_df articles. Ties keep insertion order, like a stable sort
+  def top_k(self, k, min_df=3, stopwords=frozenset()):
+    candidates = ((t, len(p)) for t, p in self.postings.items()
+                  if len(p) >= min_df and t not in stopwords)
+
+    return [t for t, _ in heapq.nlargest(k, candidates, key=lambda x: x[1])]
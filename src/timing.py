@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import resource
+import tracemalloc
+from contextlib import contextmanager
+
+# Peak resident set size of this process or of its largest finished child,
+# worker pools included, in bytes
+def peak_rss():
+  scale    = 1 if sys.platform == 'darwin' else 1024
+  own      = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+  return max(own, children) * scale
+
+# Wall time, items processed and RSS growth of named pipeline stages. Peak
+# RSS only ever grows, so each stage is charged how much it raised it and a
+# stage fitting under an earlier peak is charged nothing. A stage entered
+# several times adds up, stages are reported in first-entered order. With a
+# log_path every finished stage and every logged event is appended to it as
+# a json line. With a profile_dir outermost stages are run under cProfile,
+# and with trace_memory under tracemalloc, each leaving a dump
+class Timings:
+  def __init__(self, log_path=None, profile_dir=None, trace_memory=False):
+    self.stages       = {}
+    self.log_path     = log_path
+    self.profile_dir  = profile_dir
+    self.trace_memory = trace_memory
+    self.depth        = 0
+    self.run          = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    for path in (os.path.dirname(log_path or ''), profile_dir):
+      if path:
+        os.makedirs(path, exist_ok=True)
+
+  def get_stage(self, name):
+    if name not in self.stages:
+      self.stages[name] = {'seconds': 0.0, 'calls': 0, 'items': 0,
+                           'rss_growth': 0}
+
+    return self.stages[name]
+
+  # Time a block as a stage. Items only known once the block is done can be
+  # added to the 'items' of the yielded entry
+  @contextmanager
+  def stage(self, name, items=0):
+    entry  = self.get_stage(name)
+    before = entry['items']
+    entry['items'] += items
+
+    outermost = self.depth == 0
+    profiler  = self.start_profile() if outermost else None
+    self.depth += 1
+
+    start = time.perf_counter()
+    rss   = peak_rss()
+    try:
+      yield entry
+    finally:
+      seconds     = time.perf_counter() - start
+      self.depth -= 1
+
+      growth      = peak_rss() - rss
+
+      entry['seconds']    += seconds
+      entry['calls']      += 1
+      entry['rss_growth'] += growth
+
+      fields = {'seconds': seconds, 'items': entry['items'] - before,
+                'rss_growth': growth}
+      if outermost:
+        fields.update(self.stop_profile(name, entry['calls'], profiler))
+      self.log('stage', stage=name, **fields)
+
+  # Add a stage timed elsewhere, e.g. in a worker process
+  def record(self, name, seconds, items=0):
+    entry = self.get_stage(name)
+    entry['seconds'] += seconds
+    entry['calls']   += 1
+    entry['items']   += items
+
+    self.log('stage', stage=name, seconds=seconds, items=items)
+
+  def log(self, event, **fields):
+    if not self.log_path:
+      return
+
+    record = {'run': self.run, 'time': time.time(), 'event': event}
+    record.update(fields)
+    with open(self.log_path, 'a') as f:
+      f.write(json.dumps(record) + '\n')
+
+  def start_profile(self):
+    if self.trace_memory:
+      if not tracemalloc.is_tracing():
+        tracemalloc.start()
+      elif hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+    if not self.profile_dir:
+      return None
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+  # Write the dumps of a profiled stage, returns fields to log with it
+  def stop_profile(self, name, call, profiler):
+    fields = {}
+    prefix = f'{name.replace("/", "-")}-{call}'
+
+    if profiler:
+      profiler.disable()
+      fields['profile'] = os.path.join(self.profile_dir, f'{prefix}.prof')
+      profiler.dump_stats(fields['profile'])
+
+    if self.trace_memory and tracemalloc.is_tracing():
+      fields['traced_peak'] = tracemalloc.get_traced_memory()[1]
+
+      if self.profile_dir:
+        fields['memory'] = os.path.join(self.profile_dir, f'{prefix}.mem.txt')
+        with open(fields['memory'], 'w') as f:
+          for stat in tracemalloc.take_snapshot().statistics('lineno')[:25]:
+            f.write(f'{stat}\n')
+
+    return fields
+
+  # Stages with their throughput in items per second
+  def report(self):
+    report = {}
+    for name, entry in self.stages.items():
+      report[name] = dict(entry)
+      report[name]['throughput'] = (entry['items'] / entry['seconds']
+                                    if entry['seconds'] > 0 else 0.0)
+
+    return report